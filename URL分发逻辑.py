@@ -6,26 +6,37 @@ import signal
 import sys
 import argparse
 import requests
+from sharded_queue import ShardedURLQueue
+from http_pool import ConnectionManager
+from link_discovery import canonicalize_seed
+from serialization import QUEUE_CODEC, CODECS
 
 class URLDistributor:
-    def __init__(self, redis_host: str = 'localhost', redis_port: int = 6379, redis_db: int = 0, queue_name: str = 'url_queue'):
+    def __init__(self, redis_host: str = 'localhost', redis_port: int = 6379, redis_db: int = 0, queue_name: str = 'url_queue',
+                 redis_nodes: list = None, codec: str = QUEUE_CODEC):
         """
         初始化 Redis 连接，配置日志和队列信息
         :param redis_host: Redis服务器地址
         :param redis_port: Redis服务器端口
         :param redis_db: Redis数据库编号
         :param queue_name: URL队列名称
+        :param redis_nodes: 可选的 Redis 节点列表（"host:port/db"），提供时队列、去重集合和结果按主机名分片到这些节点
+        :param codec: 分片队列载荷的编解码，与工作进程一致
         """
         self.redis_host = redis_host
         self.redis_port = redis_port
         self.redis_db = redis_db
         self.queue_name = queue_name
         self.redis_client = None
+        self.shards = None
         self.running = False  # 控制线程运行的标志
+        self.http = ConnectionManager(default_pool_size=4, idle_timeout=300)  # 状态上报复用长连接，每个工作线程一个会话
 
         # 初始化 Redis 连接
         if not self.connect_to_redis():
             raise RuntimeError("Failed to connect to Redis.")
+        if redis_nodes:
+            self.shards = ShardedURLQueue(redis_nodes, queue_name=queue_name, codec=codec)
 
         # 注册信号处理函数
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -63,6 +74,13 @@ class URLDistributor:
         :return: 返回 URL 或 None
         """
         try:
+            if self.shards:
+                # 在各分片间公平轮询
+                task = self.shards.dequeue_blocking(timeout=timeout)
+                if task:
+                    return task['url']
+                logging.info("Queue is empty. Waiting for new URLs...")
+                return None
             # 使用 blpop 阻塞获取队列元素，直到有元素或超时
             url_item = self.redis_client.blpop(self.queue_name, timeout=timeout)
             if url_item:
@@ -101,7 +119,7 @@ class URLDistributor:
                 if time.time() - status_heartbeat > status_interval:  # 每隔一定时间更新一次状态
                     try:
                         # 向 Flask API 发送 POST 请求，更新爬虫状态
-                        requests.post("http://localhost:5001/update_status", json={"worker_id": worker_id})
+                        self.http.session().post("http://localhost:5001/update_status", json={"worker_id": worker_id})
                         logging.info(f"Worker {worker_id} status updated.")
                     except requests.RequestException as e:
                         logging.error(f"Failed to update status for worker {worker_id}: {e}")
@@ -138,7 +156,8 @@ class URLDistributor:
         try:
             # 模拟 URL 处理逻辑
             result = f"Processed {url}"
-            self.redis_client.hset("url_results", url, result)
+            client = self.shards.client_for(url) if self.shards else self.redis_client
+            client.hset("url_results", url, result)
             logging.info(f"URL processed: {url}")
         except Exception as e:
             logging.error(f"Failed to process URL {url}: {e}")
@@ -146,9 +165,15 @@ class URLDistributor:
     def add_url_to_queue(self, url: str):
         """
         将 URL 添加到 Redis 队列中，并确保 URL 不重复
+        URL 先规范化并记入 discovered_urls，之后从页面中发现同一链接时不会重复入队
         :param url: 要添加的 URL
         """
         try:
+            if self.shards:
+                self.shards.enqueue_with_dedup(url)
+                return
+            url = canonicalize_seed(url)
+            self.redis_client.sadd("discovered_urls", url)
             if not self.redis_client.sismember("processed_urls", url):
                 self.redis_client.rpush(self.queue_name, url)
                 self.redis_client.sadd("processed_urls", url)
@@ -175,8 +200,10 @@ class URLDistributor:
 
     def close(self):
         """
-        关闭 Redis 连接
+        关闭 Redis 连接和 HTTP 连接池
         """
+        self.http.log_stats()
+        self.http.close()
         if self.redis_client:
             self.redis_client.close()
             logging.info("Redis connection closed.")
@@ -201,6 +228,8 @@ if __name__ == '__main__':
     parser.add_argument('--redis_port', type=int, default=6379, help='Redis server port')
     parser.add_argument('--redis_db', type=int, default=0, help='Redis database number')
     parser.add_argument('--queue_name', type=str, default='url_queue', help='Redis queue name')
+    parser.add_argument('--redis_nodes', type=str, nargs='*', default=None, help='Shard the queue across these Redis nodes (host:port/db)')
+    parser.add_argument('--queue_codec', type=str, default=QUEUE_CODEC, choices=list(CODECS), help='Sharded queue payload codec')
     parser.add_argument('--num_workers', type=int, default=3, help='Number of worker threads')
     parser.add_argument('--url_file', type=str, default=None, help='Path to file containing URLs')
     args = parser.parse_args()
@@ -210,7 +239,9 @@ if __name__ == '__main__':
         redis_host=args.redis_host,
         redis_port=args.redis_port,
         redis_db=args.redis_db,
-        queue_name=args.queue_name
+        queue_name=args.queue_name,
+        redis_nodes=args.redis_nodes,
+        codec=args.queue_codec
     )
 
     # 添加 URL 到队列
@@ -4,7 +4,8 @@ from retry import retry
 # 配置日志记录
 logging.basicConfig(filename='error.log', level=logging.ERROR)
 
-@retry(tries=3, delay=2)
+# 指数退避加随机抖动，避免多个工作进程同时重试冲击数据库；抓取失败的 URL 由 retry_queue 延迟重试，不在此阻塞
+@retry(tries=3, delay=1, backoff=2, max_delay=10, jitter=(0, 1))
 def insert_data_with_retry(data):
     """
     带有重试机制的数据插入函数
@@ -0,0 +1,298 @@
+# 抓取检查点
+## 将队列、处理中列表、去重集合、重试队列和各主机限速状态流式导出为 zstd 压缩文件，
+## 并用 pipeline 批量恢复，Redis 被清空或迁移机器后无需重新播种和重新抓取。
+
+import os
+import json
+import time
+import fcntl
+import struct
+import logging
+import argparse
+
+import zstandard as zstd
+
+BATCH_SIZE = 10000  # 每次 SCAN/LRANGE 读取和每个恢复 pipeline 写入的元素数量
+ZSTD_LEVEL = 3
+MANIFEST_FILE = 'manifest.json'
+
+_LEN = struct.Struct('<I')
+_SCORE = struct.Struct('<d')
+
+
+def queue_keys(queue):
+    """
+    列出队列涉及的所有 Redis 键
+    :param queue: RedisURLQueue 或 ShardedURLQueue
+    :return: (client, key, type) 列表
+    """
+    if hasattr(queue, 'owners'):  # ShardedURLQueue
+        keys = []
+        for partition, owner in enumerate(queue.owners):
+            client = queue.clients[owner]
+            queue_key, processed_key, processing_key = queue._keys(partition)
+            keys += [(client, queue_key, 'list'), (client, processing_key, 'list'), (client, processed_key, 'set'),
+                     (client, queue._discovered_key(partition), 'set')]
+        return keys
+    client = queue.redis_client
+    return [(client, queue.queue_name, 'list'), (client, 'processing_queue', 'list'),
+            (client, queue.processed_set, 'set'), (client, queue.discovered_set, 'set')]
+
+
+def client_for_key(queue, key, default_client):
+    """
+    恢复时确定键应写入的节点：分片队列的分区键按当前哈希环路由，其他键写入默认客户端
+    """
+    if hasattr(queue, 'owners'):
+        prefix, _, partition = key.rpartition(':')
+        if partition.isdigit() and prefix in (queue.queue_name, queue.processed_set, queue.processing_queue,
+                                              queue.discovered_set):
+            return queue.clients[queue.owners[int(partition)]]
+    elif key in (queue.queue_name, queue.processed_set, 'processing_queue', queue.discovered_set):
+        return queue.redis_client
+    return default_client
+
+
+def _write_record(writer, value, score=None):
+    writer.write(_LEN.pack(len(value)))
+    writer.write(value)
+    if score is not None:
+        writer.write(_SCORE.pack(score))
+
+
+def _read_exact(reader, size):
+    data = b''
+    while len(data) < size:
+        chunk = reader.read(size - len(data))
+        if not chunk:
+            if data:
+                raise EOFError("Truncated checkpoint file")
+            return None
+        data += chunk
+    return data
+
+
+def _iter_records(reader, with_score=False):
+    while True:
+        header = _read_exact(reader, _LEN.size)
+        if header is None:
+            return
+        value = _read_exact(reader, _LEN.unpack(header)[0])
+        if with_score:
+            yield value, _SCORE.unpack(_read_exact(reader, _SCORE.size))[0]
+        else:
+            yield value, None
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+
+def _dump_key(client, key, key_type, writer):
+    """
+    分批流式导出一个键，每批一次短命令，不阻塞 Redis 和工作进程
+    :return: 导出的元素数量
+    """
+    count = 0
+    if key_type == 'list':
+        # 从尾部向前读取：消费者从头部弹出不影响负下标，生产者追加只会造成少量重复而不会遗漏；
+        # 记录按从后到前的顺序写入，恢复时用 LPUSH 逐个前插即可还原原有顺序
+        end = -1
+        while True:
+            items = client.lrange(key, end - BATCH_SIZE + 1, end)
+            if not items:
+                break
+            for item in reversed(items):
+                _write_record(writer, _to_bytes(item))
+            count += len(items)
+            if len(items) < BATCH_SIZE:
+                break
+            end -= BATCH_SIZE
+    elif key_type == 'set':
+        cursor = 0
+        while True:
+            cursor, members = client.sscan(key, cursor, count=BATCH_SIZE)
+            for member in members:
+                _write_record(writer, _to_bytes(member))
+            count += len(members)
+            if cursor == 0:
+                break
+    elif key_type == 'zset':
+        cursor = 0
+        while True:
+            cursor, members = client.zscan(key, cursor, count=BATCH_SIZE)
+            for member, score in members:
+                _write_record(writer, _to_bytes(member), score)
+            count += len(members)
+            if cursor == 0:
+                break
+    elif key_type == 'hash':
+        cursor = 0
+        while True:
+            cursor, fields = client.hscan(key, cursor, count=BATCH_SIZE)
+            for field, value in fields.items():
+                _write_record(writer, _to_bytes(field))
+                _write_record(writer, _to_bytes(value))
+            count += len(fields)
+            if cursor == 0:
+                break
+    return count
+
+
+def save_checkpoint(checkpoint_dir, queue, retry_queue=None, redis_client=None, extra_keys=()):
+    """
+    保存检查点
+    :param checkpoint_dir: 检查点目录
+    :param queue: RedisURLQueue 或 ShardedURLQueue
+    :param retry_queue: 可选的 RetryQueue，一并导出重试有序集合和死信队列
+    :param redis_client: 保存各主机限速状态（HOST_STATE_KEY，所有工作进程共享）的 Redis 客户端
+    :param extra_keys: 额外导出的 (client, key, type) 列表
+    :return: manifest 字典
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    keys = list(queue_keys(queue))
+    if retry_queue is not None:
+        keys += [(retry_queue.redis_client, retry_queue.retry_set, 'zset'),
+                 (retry_queue.redis_client, retry_queue.dead_letter_queue, 'list')]
+    if redis_client is not None:
+        from rate_control import HOST_STATE_KEY
+        keys.append((redis_client, HOST_STATE_KEY, 'hash'))
+    keys += list(extra_keys)
+
+    start = time.time()
+    compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+    entries = []
+    for index, (client, key, key_type) in enumerate(keys):
+        if not client.exists(key):
+            continue
+        filename = f"{index:05d}.{key_type}.zst"
+        path = os.path.join(checkpoint_dir, filename)
+        with open(path + '.tmp', 'wb') as file, compressor.stream_writer(file) as writer:
+            count = _dump_key(client, key, key_type, writer)
+        os.replace(path + '.tmp', path)
+        entries.append({'key': key, 'type': key_type, 'file': filename, 'count': count})
+        logging.info(f"已导出 {key}（{key_type}）: {count} 个元素")
+
+    manifest = {'created_at': start, 'duration': time.time() - start, 'keys': entries}
+    with open(os.path.join(checkpoint_dir, MANIFEST_FILE), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=4)
+    logging.info(f"检查点已保存到 {checkpoint_dir}，耗时 {manifest['duration']:.1f} 秒")
+    return manifest
+
+
+def restore_checkpoint(checkpoint_dir, queue, redis_client, replace=False):
+    """
+    从检查点恢复，使用 pipeline 批量写入
+    :param checkpoint_dir: 检查点目录
+    :param queue: RedisURLQueue 或 ShardedURLQueue，分区键按当前节点列表重新路由
+    :param redis_client: 非队列键（重试队列、限速状态等）写入的 Redis 客户端
+    :param replace: 是否先删除目标键（否则与现有数据合并）
+    :return: 恢复的元素总数
+    """
+    with open(os.path.join(checkpoint_dir, MANIFEST_FILE), 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+
+    start = time.time()
+    decompressor = zstd.ZstdDecompressor()
+    total = 0
+    for entry in manifest['keys']:
+        key, key_type = entry['key'], entry['type']
+        client = client_for_key(queue, key, redis_client)
+        if replace:
+            client.delete(key)
+        with open(os.path.join(checkpoint_dir, entry['file']), 'rb') as file, \
+                decompressor.stream_reader(file) as reader:
+            records = _iter_records(reader, with_score=key_type == 'zset')
+            batch = []
+            count = 0
+            for value, score in records:
+                if key_type == 'hash':
+                    batch.append((value, next(records)[0]))
+                else:
+                    batch.append((value, score))
+                if len(batch) >= BATCH_SIZE:
+                    _load_batch(client, key, key_type, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                _load_batch(client, key, key_type, batch)
+                count += len(batch)
+        total += count
+        logging.info(f"已恢复 {key}（{key_type}）: {count} 个元素")
+    logging.info(f"检查点恢复完成，共 {total} 个元素，耗时 {time.time() - start:.1f} 秒")
+    return total
+
+
+def _load_batch(client, key, key_type, batch):
+    pipe = client.pipeline(transaction=False)
+    if key_type == 'list':
+        # 记录按从后到前的顺序保存，LPUSH 逐个前插后恢复原有顺序
+        pipe.lpush(key, *[value for value, _ in batch])
+    elif key_type == 'set':
+        pipe.sadd(key, *[value for value, _ in batch])
+    elif key_type == 'zset':
+        pipe.zadd(key, {value: score for value, score in batch})
+    elif key_type == 'hash':
+        pipe.hset(key, mapping=dict(batch))
+    pipe.execute()
+
+
+def save_item_ids(item_ids, path):
+    """
+    保存 1688 商品去重集合（清洗阶段的进程内 item_id），与文件中已有的内容合并
+    多个工作进程可能同时保存，读取、合并和替换在文件锁内完成，不会丢失其他进程写入的内容
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f"{path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            merged = set(item_ids) | load_item_ids(path)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as file, zstd.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file) as writer:
+                for item in merged:
+                    _write_record(writer, item.encode('utf-8'))
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_item_ids(path):
+    """
+    加载 1688 商品去重集合，文件不存在时返回空集合
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb') as file, zstd.ZstdDecompressor().stream_reader(file) as reader:
+        return {value.decode('utf-8') for value, _ in _iter_records(reader)}
+
+
+if __name__ == '__main__':
+    import redis
+    from redis_url_queue import RedisURLQueue
+    from sharded_queue import ShardedURLQueue
+    from retry_queue import RetryQueue
+    from serialization import QUEUE_CODEC, CODECS
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Crawl checkpoint and resume")
+    parser.add_argument('command', choices=['save', 'restore'], help='Save a checkpoint or restore from one')
+    parser.add_argument('--dir', type=str, required=True, help='Checkpoint directory')
+    parser.add_argument('--redis_host', type=str, default='localhost', help='Redis server address')
+    parser.add_argument('--redis_port', type=int, default=6379, help='Redis server port')
+    parser.add_argument('--redis_db', type=int, default=0, help='Redis database number')
+    parser.add_argument('--redis_nodes', type=str, nargs='*', default=None, help='Sharded queue nodes (host:port/db)')
+    parser.add_argument('--replace', action='store_true', help='Delete existing keys before restoring')
+    parser.add_argument('--codec', type=str, default=QUEUE_CODEC, choices=list(CODECS), help='Queue payload codec')
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    if args.redis_nodes:
+        queue = ShardedURLQueue(args.redis_nodes, codec=args.codec)
+    else:
+        queue = RedisURLQueue(host=args.redis_host, port=args.redis_port, db=args.redis_db, codec=args.codec)
+
+    if args.command == 'save':
+        save_checkpoint(args.dir, queue, RetryQueue(queue, client), client)
+    else:
+        restore_checkpoint(args.dir, queue, client, replace=args.replace)
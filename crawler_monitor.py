@@ -1,3 +1,4 @@
+import json
 import redis
 from flask import Flask, jsonify, request
 
@@ -22,5 +23,22 @@ def update_status():
     redis_client.hset("crawler_status", data["worker_id"], time.time())
     return jsonify({"status": "updated"})
 
+@app.route('/host_limits', methods=['GET'])
+def host_limits():
+    """
+    查看各工作进程对每个主机的当前并发数和速率限制（AIMD 自适应调整）
+    可选参数 host 只返回指定主机
+    """
+    from rate_control import HOST_LIMITS_KEY, prune_host_limits
+    prune_host_limits(redis_client)
+    host_filter = request.args.get('host')
+    limits = {}
+    for field, value in redis_client.hgetall(HOST_LIMITS_KEY).items():
+        worker, _, host = field.partition('|')
+        if host_filter and host != host_filter:
+            continue
+        limits.setdefault(host, {})[worker] = json.loads(value)
+    return jsonify(limits)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001)
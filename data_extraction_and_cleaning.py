@@ -1,83 +1,398 @@
 import random
 import re
 import time
-import pymongo
+import argparse
 import requests
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
 import json
+import zlib
 import logging
-import pandas as pd
-import importlib.util
-from bs4 import BeautifulSoup
-from pymongo import IndexModel, ASCENDING
-from DNS_extraction import DNSResolver  # 导入 DNS 解析模块
-
-# 初始化 DNS 解析器
-dns_resolver = DNSResolver()
-
-# 使用解析器解析 URL
-ip = dns_resolver.resolve_url("example.com")
-print("Resolved IP:", ip)
+import threading
+from collections import namedtuple
+from rate_control import parse_retry_after
+from retry_queue import classify_status
+from serialization import loads_json, dumps_json
 
+# pandas、bs4、pymongo 等重量级库以及 Mongo/Redis 客户端均在首次使用时才初始化，
+# 导入本模块不产生任何网络请求，工作进程可以快速启动（见 worker_launcher.py）
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# 使用会话复用
-session = requests.Session()
-
 # 配置重试参数
 REDIS_MAX_RETRIES = 3
 REDIS_RETRY_DELAY = 5  # 秒
-REQUEST_MAX_RETRIES = 3
 REQUEST_TIMEOUT = 10  # 秒
+RATE_ACQUIRE_TIMEOUT = 0.2  # 等待主机限速许可的最长时间（秒），超过则暂缓该 URL、先处理其他主机
+
+# 分片队列节点列表（"host:port/db"），为空时使用单个 Redis 节点
+REDIS_QUEUE_NODES = []
+
+# 响应体流式读取参数
+RESPONSE_MAX_BYTES = 10 * 1024 * 1024  # 解压后响应体的最大字节数
+RESPONSE_CHUNK_SIZE = 64 * 1024  # 每次从连接读取的字节数
+CHARSET_SNIFF_BYTES = 4096  # 只在响应体前缀中探测字符集
+ALLOWED_CONTENT_TYPES = (
+    'text/html', 'application/xhtml+xml',
+    'application/json', 'text/json',
+    'application/javascript', 'text/javascript', 'text/plain',
+)
+
+# 清洗阶段商品去重集合的持久化文件，工作进程启动时加载、退出时合并保存，设为 None 则不持久化
+ITEM_ID_CHECKPOINT = 'checkpoints/item_ids.zst'
+
+# 原始页面归档目录，设为 None 则不归档
+PAGE_ARCHIVE_DIR = 'page_archive'
+
+# HTTP 连接池：{主机名: 连接数上限}、{代理地址: 连接数上限}，未列出的使用默认值（见 http_pool.py）
+HTTP_POOL_SIZES = {}
+HTTP_PROXY_POOL_SIZES = {}
+HTTP_IDLE_TIMEOUT = 60  # 连接池空闲多久后回收（秒）
+
+# 原始响应体字节及其编码，HTML 直接交给解析器，不生成中间 str
+RawPage = namedtuple('RawPage', ['body', 'encoding', 'content_type'])
+
+
+class ResponseRejected(Exception):
+    """
+    响应被主动拒绝（类型不允许、超出大小限制等），重试也无济于事
+    """
+
+
+class FetchFailed(Exception):
+    """
+    请求失败，按错误类别交给延迟重试队列
+    """
+
+    def __init__(self, error_class, message, retry_after=None):
+        super().__init__(message)
+        self.error_class = error_class
+        self.retry_after = retry_after
+
+
+class FetchDeferred(FetchFailed):
+    """
+    主机限速暂不允许发送，请求没有发出，延迟后重新入队且不计入重试次数
+    """
+
+    def __init__(self, delay):
+        super().__init__('deferred', f"主机限速，{delay:.1f} 秒后再试")
+        self.delay = delay
 
 # 从 config.py 中导入配置
 from config import *
 
-# 连接 MongoDB
-client = pymongo.MongoClient(MONGO_URI)
-db = client[MONGO_DB]
 item_id = set()
 
-# 在 MongoDB 集合中创建索引
-db[MONGO_TABLE].create_index([("url", ASCENDING)], unique=True)  # URL 唯一索引
-db[MONGO_TABLE].create_index([("title", ASCENDING)])  # Title 索引
-db[MONGO_TABLE].create_index([("timestamp", ASCENDING)])  # Timestamp 索引
+# 延迟初始化的客户端，在每个（fork 之后的）进程中首次使用时创建
+_mongo_client = None
+_dns_resolver = None
+_page_archive = None
+_rate_controller = None
+_redis_client = None
+_connection_manager = None
+
+# 停止请求：设置后工作进程处理完当前任务即退出主循环（见 worker_launcher.py 的信号处理）
+_stop_requested = threading.Event()
+
+def request_stop():
+    """
+    请求工作进程在当前任务处理完后退出，可在信号处理函数中调用
+    """
+    _stop_requested.set()
+
+def warm_imports():
+    """
+    预先导入重量级库但不创建任何客户端，供 prefork 启动器在 fork 之前调用
+    """
+    import pandas  # noqa: F401
+    import bs4  # noqa: F401
+    import lxml.etree  # noqa: F401
+    import pymongo  # noqa: F401
+    import redis  # noqa: F401
+    import page_archive  # noqa: F401
+    import link_discovery  # noqa: F401
+    import redis_url_queue  # noqa: F401
+    import sharded_queue  # noqa: F401
+    import http_pool  # noqa: F401
+
+def get_db():
+    """
+    获取 MongoDB 数据库，首次调用时建立连接
+    """
+    global _mongo_client
+    if _mongo_client is None:
+        import pymongo
+        _mongo_client = pymongo.MongoClient(MONGO_URI)
+    return _mongo_client[MONGO_DB]
+
+def get_dns_resolver():
+    """
+    获取 DNS 解析器，首次调用时创建
+    """
+    global _dns_resolver
+    if _dns_resolver is None:
+        from DNS_extraction import DNSResolver
+        _dns_resolver = DNSResolver()
+    return _dns_resolver
+
+def get_page_archive():
+    """
+    获取原始页面归档，修改提取规则后可用 `python page_archive.py reextract` 重放
+    :return: PageArchive 实例，PAGE_ARCHIVE_DIR 为 None 时返回 None
+    """
+    global _page_archive
+    if _page_archive is None and PAGE_ARCHIVE_DIR:
+        from page_archive import PageArchive
+        _page_archive = PageArchive(PAGE_ARCHIVE_DIR)
+    return _page_archive
+
+def get_redis():
+    """
+    获取本地 Redis 客户端（限速状态发布、集合版本号等），首次调用时创建
+    """
+    global _redis_client
+    if _redis_client is None:
+        import redis
+        _redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+    return _redis_client
+
+def get_rate_controller():
+    """
+    获取按主机的自适应限速控制器，各主机的限制和许可保存在 Redis 中，所有工作进程共同遵守
+    """
+    global _rate_controller
+    if _rate_controller is None:
+        from rate_control import AdaptiveRateController
+        _rate_controller = AdaptiveRateController(redis_client=get_redis())
+    return _rate_controller
+
+def get_connection_manager():
+    """
+    获取 HTTP 连接管理器（按主机和代理复用长连接），首次调用时创建
+    """
+    global _connection_manager
+    if _connection_manager is None:
+        from http_pool import ConnectionManager
+        _connection_manager = ConnectionManager(pool_sizes=HTTP_POOL_SIZES, proxy_pool_sizes=HTTP_PROXY_POOL_SIZES,
+                                                idle_timeout=HTTP_IDLE_TIMEOUT)
+    return _connection_manager
+
+def setup_indexes():
+    """
+    在 MongoDB 集合中创建索引，部署时执行一次：python data_extraction_and_cleaning.py setup
+    """
+    from pymongo import ASCENDING
+    from product_aggregates import ensure_indexes
+    collection = get_db()[MONGO_TABLE]
+    collection.create_index([("url", ASCENDING)], unique=True)  # URL 唯一索引
+    collection.create_index([("title", ASCENDING)])  # Title 索引
+    collection.create_index([("timestamp", ASCENDING)])  # Timestamp 索引
+    ensure_indexes(get_db(), MONGO_TABLE)  # 汇总集合索引
+    logging.info(f"已在集合 {MONGO_TABLE} 上创建索引")
 
 def get_proxy():
     '''
     获取代理
     '''
-    return requests.get("http://127.0.0.1:5010/get/").text
+    return get_connection_manager().session().get("http://127.0.0.1:5010/get/").text
 
-def fetch_page_content(url):
+class _StreamDecoder:
     """
-    从指定 URL 获取网页内容，添加重试机制
+    按 Content-Encoding 对响应体做增量解压，每次输出不超过 limit 字节
+    gzip 响应体可能由多个成员拼接而成，一个成员结束后继续解压后续成员
+    """
+
+    def __init__(self, content_encoding):
+        encoding = (content_encoding or 'identity').strip().lower()
+        if encoding in ('', 'identity'):
+            self._obj = None
+        elif encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._members = 0  # 已解压完的 gzip 成员数
+            self._discard = False  # 最后一个成员之后的填充字节，与 urllib3 一样忽略
+        elif encoding == 'deflate':
+            self._obj = zlib.decompressobj()
+            self._first_try = True
+        else:
+            raise ResponseRejected(f"不支持的 Content-Encoding: {content_encoding}")
+        self._encoding = encoding
+
+    def decompress(self, data, limit):
+        if self._obj is None:
+            return data[:limit + 1]
+        if self._encoding != 'deflate':
+            return self._decompress_gzip(data, limit)
+        if self._first_try:
+            # 部分服务器返回不带 zlib 头的裸 deflate 数据
+            self._first_try = False
+            try:
+                return self._obj.decompress(data, limit + 1)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            return self._obj.decompress(data, limit + 1)
+        except zlib.error as e:
+            raise ResponseRejected(f"响应体解压失败: {e}")
+
+    def _decompress_gzip(self, data, limit):
+        output = b''
+        while data and not self._discard:
+            if self._obj.eof:
+                self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._members += 1
+            try:
+                output += self._obj.decompress(data, limit + 1 - len(output))
+            except zlib.error as e:
+                if self._members == 0:
+                    raise ResponseRejected(f"响应体解压失败: {e}")
+                self._discard = True
+                break
+            if len(output) > limit:
+                break
+            data = self._obj.unused_data if self._obj.eof else b''
+        return output
+
+    def flush(self):
+        """
+        输出解压器中剩余的数据，响应体读取完毕后调用
+        """
+        if self._obj is None or (self._encoding != 'deflate' and self._discard):
+            return b''
+        try:
+            return self._obj.flush()
+        except zlib.error as e:
+            raise ResponseRejected(f"响应体解压失败: {e}")
+
+def detect_charset(content_type, prefix):
+    """
+    探测响应体的字符集，只检查 Content-Type 头和响应体前缀
+    :param content_type: 响应的 Content-Type 头
+    :param prefix: 响应体的前 CHARSET_SNIFF_BYTES 个字节
+    :return: 字符集名称，探测不到时返回 None，交给解析器自行判断
+    """
+    match = re.search(r'charset=["\']?([\w.:-]+)', content_type or '', re.I)
+    if match:
+        return match.group(1)
+    if prefix.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8'
+    if prefix.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'
+    match = re.search(rb'<meta[^>]+charset=["\']?([\w.:-]+)', prefix[:CHARSET_SNIFF_BYTES], re.I)
+    if match:
+        return match.group(1).decode('ascii')
+    match = re.search(rb'<\?xml[^>]+encoding=["\']([\w.:-]+)', prefix[:CHARSET_SNIFF_BYTES], re.I)
+    if match:
+        return match.group(1).decode('ascii')
+    return None
+
+def read_limited_body(response, max_bytes=RESPONSE_MAX_BYTES):
+    """
+    流式读取响应体，边读边解压，超过大小限制时立即中止
+    :param response: 以 stream=True 发起的请求的响应
+    :param max_bytes: 解压后允许的最大字节数
+    :return: 响应体字节
+    """
+    content_length = response.headers.get('Content-Length')
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise ResponseRejected(f"响应体过大: Content-Length={content_length}")
+
+    decoder = _StreamDecoder(response.headers.get('Content-Encoding'))
+    body = bytearray()
+    for chunk in response.raw.stream(RESPONSE_CHUNK_SIZE, decode_content=False):
+        body += decoder.decompress(chunk, max_bytes - len(body))
+        if len(body) > max_bytes:
+            raise ResponseRejected(f"响应体超过 {max_bytes} 字节，已中止读取")
+    body += decoder.flush()
+    if len(body) > max_bytes:
+        raise ResponseRejected(f"响应体超过 {max_bytes} 字节，已中止读取")
+    return bytes(body)
+
+def fetch_page(url):
+    """
+    从指定 URL 获取网页内容，只尝试一次，失败时抛出 FetchFailed 交给延迟重试队列处理
+    响应体以流式方式读取，受 RESPONSE_MAX_BYTES 限制，不允许的 Content-Type 在下载响应体前即被拒绝
+    每次请求前按主机向自适应限速控制器申请许可，最多等待 RATE_ACQUIRE_TIMEOUT 秒，
+    未获得许可时抛出 FetchDeferred，由调用方暂缓该 URL，单线程工作进程不会被一个受限主机拖住；请求结果反馈给控制器
     :param url: 要请求的 URL
-    :return: 网页的 HTML 内容，如果请求失败则返回 None
+    :return: 原始页面 RawPage，响应被拒绝时返回 None
     """
-    retries = 0
-    while retries < REQUEST_MAX_RETRIES:
+    host = urlsplit(url).hostname or url
+    rate_controller = get_rate_controller()
+    if not rate_controller.acquire(host, timeout=RATE_ACQUIRE_TIMEOUT):
+        raise FetchDeferred(rate_controller.wait_time(host))
+    try:
         try:
             proxy = get_proxy()
-            headers = {
-                'User_Agent': random.choice(USER_AGENT),
-                'Referer': 'https://p4psearch.1688.com/p4p114/p4psearch/offer.htm?keywords=' + quote(
-                    KEYWORD) + '&sortType=&descendOrder=&province=&city=&priceStart=&priceEnd=&dis=&provinceValue=%E6%89%80%E5%9C%A8%E5%9C%B0%E5%8C%BA',
-                'Cookie': COOKIE,
-            }
-            proxies = {"http": "http://{}".format(proxy)}
-            response = session.get(url, headers=headers, proxies=proxies, timeout=REQUEST_TIMEOUT)
+        except Exception:
+            rate_controller.cancel(host)  # 请求尚未发出，归还许可
+            raise
+        headers = {
+            'User_Agent': random.choice(USER_AGENT),
+            'Referer': 'https://p4psearch.1688.com/p4p114/p4psearch/offer.htm?keywords=' + quote(
+                KEYWORD) + '&sortType=&descendOrder=&province=&city=&priceStart=&priceEnd=&dis=&provinceValue=%E6%89%80%E5%9C%A8%E5%9C%B0%E5%8C%BA',
+            'Cookie': COOKIE,
+            'Accept-Encoding': 'gzip, deflate',
+        }
+        proxies = {"http": "http://{}".format(proxy)}
+        start = time.time()
+        try:
+            response = get_connection_manager().session().get(url, headers=headers, proxies=proxies, timeout=REQUEST_TIMEOUT, stream=True)
+        except Exception:
+            rate_controller.release(host, latency=time.time() - start, error=True)
+            raise
+        # 延迟按收到响应头计算，429/503 会触发减速并遵守 Retry-After
+        rate_controller.release(host, response.status_code, time.time() - start,
+                                response.headers.get('Retry-After'))
+        with response:
             response.raise_for_status()  # 检查请求是否成功
-            return response.text if 'html' in response.headers.get('Content-Type', '') else response.json()
-        except requests.RequestException as e:
-            logging.error(f"请求 {url} 时出现错误 (尝试第 {retries + 1} 次): {e}")
-            retries += 1
-            if retries < REQUEST_MAX_RETRIES:
-                time.sleep(1)  # 等待 1 秒后重试
-    logging.error(f"请求 {url} 失败，已达到最大重试次数。")
-    return None
+            content_type = response.headers.get('Content-Type', '')
+            mime_type = content_type.split(';', 1)[0].strip().lower()
+            if mime_type not in ALLOWED_CONTENT_TYPES:
+                raise ResponseRejected(f"不允许的 Content-Type: {content_type}")
+            body = read_limited_body(response)
+        return RawPage(body, detect_charset(content_type, body[:CHARSET_SNIFF_BYTES]), content_type)
+    except ResponseRejected as e:
+        logging.warning(f"放弃 {url}: {e}")
+        return None
+    except requests.HTTPError as e:
+        status = e.response.status_code
+        logging.error(f"请求 {url} 时出现错误: {e}")
+        raise FetchFailed(classify_status(status), str(e),
+                          parse_retry_after(e.response.headers.get('Retry-After')))
+    except requests.RequestException as e:
+        logging.error(f"请求 {url} 时出现错误: {e}")
+        raise FetchFailed('network', str(e))
+
+def decode_page(page):
+    """
+    解码原始页面：HTML 原样返回交给解析器，JSON 接口解析为对象
+    :param page: 原始页面 RawPage
+    :return: HTML 页面返回 RawPage，JSON 接口返回解析后的对象，解析失败返回 None
+    """
+    if 'html' in page.content_type:
+        return page
+    body = page.body
+    try:
+        if page.encoding and not page.encoding.lower().replace('-', '').replace('_', '').startswith('utf'):
+            # 非 UTF 编码的接口（如 GBK）按探测到的字符集解码，与 response.json() 一致
+            body = body.decode(page.encoding)
+        return loads_json(body)
+    except (ValueError, LookupError) as e:
+        logging.error(f"解析 JSON 响应时出错: {e}")
+        return None
+
+def fetch_page_content(url):
+    """
+    从指定 URL 获取网页内容
+    :param url: 要请求的 URL
+    :return: HTML 页面返回 RawPage，JSON 接口返回解析后的对象，如果请求失败则返回 None
+    """
+    try:
+        page = fetch_page(url)
+    except FetchFailed:
+        return None
+    return decode_page(page) if page else None
 
 def load_extraction_rules():
     """
@@ -99,10 +414,21 @@ def load_extraction_rules():
         logging.error(f"解析提取规则配置文件时出错: {e}")
         return {}
 
+def parse_html(html_content):
+    """
+    解析 HTML 页面，原始字节直接交给解析器
+    :param html_content: RawPage 或 HTML 字符串
+    :return: BeautifulSoup 文档
+    """
+    from bs4 import BeautifulSoup
+    if isinstance(html_content, RawPage):
+        return BeautifulSoup(html_content.body, 'lxml', from_encoding=html_content.encoding)
+    return BeautifulSoup(html_content, 'lxml')
+
 def extract_data(html_content, url, rules):
     """
     根据规则从 HTML 内容中提取数据
-    :param html_content: 网页的 HTML 内容
+    :param html_content: 网页的 HTML 内容（已解析的文档、RawPage、字符串或 JSON 数据）
     :param url: 当前处理的 URL
     :param rules: 提取规则字典
     :return: 提取到的数据列表
@@ -145,7 +471,8 @@ def extract_data(html_content, url, rules):
             return extracted_data
         except (KeyError, TypeError):
             return []
-    soup = BeautifulSoup(html_content, 'lxml')
+    from bs4 import BeautifulSoup
+    soup = html_content if isinstance(html_content, BeautifulSoup) else parse_html(html_content)
     data = []
     for domain, selectors in rules.items():
         if domain in url:
@@ -178,6 +505,7 @@ def clean_data(data):
                 cleaned_data.append(item)
                 item_id.add(item['标题'])
         return cleaned_data
+    import pandas as pd
     df = pd.DataFrame(data, columns=['text'])
     # 去除首尾空格和换行符
     df['text'] = df['text'].str.strip()
@@ -191,14 +519,49 @@ def clean_data(data):
 
     return df['text'].tolist()
 
-def save_to_mongo(data):
+def save_to_mongo(data, replace=False):
     """
     将清洗后的 1688 商品数据保存到 MongoDB
     :param data: 清洗后的商品数据列表
+    :param replace: 为 True 时按标题覆盖已有商品（从归档重放），不更新增量汇总，由调用方重算
     """
-    for item in data:
-        if db[MONGO_TABLE].insert_one(item):
-            print('成功保存至mongoDB', item['标题'])
+    from result_cache import bump_collection_version
+    from product_aggregates import pause_if_rebuilding, update_aggregates
+    collection = get_db()[MONGO_TABLE]
+    if replace:
+        from pymongo import ReplaceOne
+        if data:
+            collection.bulk_write([ReplaceOne({'标题': item['标题']}, item, upsert=True) for item in data],
+                                  ordered=False)
+            bump_collection_version(get_redis(), MONGO_TABLE)
+        return
+    if not data:
+        return
+    from pymongo.errors import BulkWriteError
+    # 汇总重算进行中时，本批商品带标记入库，由重算补记
+    paused = pause_if_rebuilding(get_redis(), MONGO_TABLE, data)
+    error = None
+    try:
+        collection.insert_many(data, ordered=False)
+        saved = data
+    except BulkWriteError as e:
+        # ordered=False 时其余商品照常写入，只有出错的商品没有入库，汇总只计入成功写入的商品
+        failed = {err['index'] for err in e.details.get('writeErrors', [])}
+        saved = [item for index, item in enumerate(data) if index not in failed]
+        if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])) or \
+                e.details.get('writeConcernErrors'):
+            error = e
+        logging.warning(f"{len(failed)} 个商品未能写入 MongoDB: {e}")
+    for item in saved:
+        print('成功保存至mongoDB', item['标题'])
+    if saved:
+        # 增量更新按省份、城市、公司类型等维度的汇总
+        if not paused:
+            update_aggregates(get_db(), MONGO_TABLE, saved)
+        # 递增集合版本号，query_api 中该集合的缓存结果随之失效
+        bump_collection_version(get_redis(), MONGO_TABLE)
+    if error is not None:
+        raise error
 
 def save_to_json(data, url):
     """
@@ -208,77 +571,161 @@ def save_to_json(data, url):
     """
     filename = url.replace('https://', '').replace('http://', '').replace('/', '_') + '.json'
     try:
-        with open(filename, 'w', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        with open(filename, 'wb') as file:
+            file.write(dumps_json(data, indent=True))
         logging.info(f"数据已保存到 {filename}")
     except Exception as e:
         logging.error(f"保存数据到 {filename} 时出错: {e}")
 
-def process_url(url, rules):
+def store_cleaned_data(cleaned_data, url, replace=False):
+    """
+    保存清洗后的数据：1688 商品信息存入 MongoDB，其他数据保存为 JSON 文件
+    :param cleaned_data: 清洗后的数据列表
+    :param url: 当前处理的 URL
+    :param replace: 是否覆盖已有商品而不是追加（从归档重放时使用）
+    """
+    if all(isinstance(item, dict) for item in cleaned_data):  # 处理 1688 商品信息
+        save_to_mongo(cleaned_data, replace)
+    else:
+        save_to_json(cleaned_data, url)
+
+def process_url(url, rules, depth=0, discoverer=None):
     """
     处理单个 URL，包括获取内容、解析 DNS、提取数据和清洗数据
     :param url: 要处理的 URL
     :param rules: 提取规则字典
+    :param depth: 当前 URL 的抓取深度
+    :param discoverer: 可选的 LinkDiscoverer，用于从 HTML 页面中发现新链接
     :return: 清洗后的数据列表
+    :raises FetchFailed: 请求失败，由调用方安排延迟重试
     """
     try:
         # 获取 URL 的 IP 地址
-        ip = dns_resolver.resolve_url(url)
+        ip = get_dns_resolver().resolve_url(url)
         if ip:
             print(f"Resolving IP for {url}: {ip}")
         else:
             print(f"Failed to resolve IP for {url}")
 
-        html_content = fetch_page_content(url)
+        page = fetch_page(url)
+        page_archive = get_page_archive()
+        if page and page_archive:
+            # 归档失败不影响本次提取
+            try:
+                page_archive.put(url, page.body, page.content_type, page.encoding)
+            except Exception as e:
+                logging.error(f"归档 {url} 时出现错误: {e}")
+        html_content = decode_page(page) if page else None
         if html_content:
+            if isinstance(html_content, RawPage):
+                # 只解析一次，提取数据和发现链接共用同一个文档
+                html_content = parse_html(html_content)
+                if discoverer:
+                    discoverer.discover(html_content, url, depth)
             extracted_data = extract_data(html_content, url, rules)
             cleaned_data = clean_data(extracted_data)
-            if all(isinstance(item, dict) for item in cleaned_data):  # 处理 1688 商品信息
-                save_to_mongo(cleaned_data)
-            else:
-                save_to_json(cleaned_data, url)
+            store_cleaned_data(cleaned_data, url)
             return cleaned_data
+    except FetchFailed:
+        raise
     except Exception as e:
         logging.error(f"处理 URL {url} 时出现错误: {e}")
     return []
 
 
-if __name__ == "__main__":
-    # 动态导入 RedisURLQueue 类
-    spec = importlib.util.spec_from_file_location("RedisURLQueueModule", "Redis URL队列实现.py")
-    RedisURLQueueModule = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(RedisURLQueueModule)
-    RedisURLQueue = RedisURLQueueModule.RedisURLQueue
+def connect_queue():
+    """
+    连接到 Redis 队列，添加重试机制
+    :return: RedisURLQueue 或 ShardedURLQueue 实例
+    """
+    from redis_url_queue import RedisURLQueue
+    from sharded_queue import ShardedURLQueue
+    from serialization import QUEUE_CODEC
 
-    # 连接到 Redis 队列，添加重试机制
     retries = 0
     while retries < REDIS_MAX_RETRIES:
         try:
-            queue = RedisURLQueue(host='localhost', port=6379, db=0)
+            if REDIS_QUEUE_NODES:
+                queue = ShardedURLQueue(REDIS_QUEUE_NODES, codec=QUEUE_CODEC)
+            else:
+                queue = RedisURLQueue(host='localhost', port=6379, db=0, codec=QUEUE_CODEC)
             logging.info("Connected to Redis successfully!")
-            break
+            return queue
         except Exception as e:
             logging.error(f"Failed to connect to Redis (尝试第 {retries + 1} 次): {e}")
             retries += 1
             if retries < REDIS_MAX_RETRIES:
                 logging.info(f"将在 {REDIS_RETRY_DELAY} 秒后重试...")
                 time.sleep(REDIS_RETRY_DELAY)
-    if retries == REDIS_MAX_RETRIES:
-        logging.error("Failed to connect to Redis after multiple attempts. Exiting.")
-        raise SystemExit(1)
+    logging.error("Failed to connect to Redis after multiple attempts. Exiting.")
+    raise SystemExit(1)
+
+def run_worker():
+    """
+    工作进程主循环：从 Redis 队列中获取 URL 并处理，直到队列和重试队列都为空
+    失败的 URL 交给延迟重试队列，工作进程不会为等待重试而阻塞
+    """
+    import redis
+    from link_discovery import LinkDiscoverer
+    from retry_queue import RetryQueue
+    from checkpoint import load_item_ids, save_item_ids
+
+    queue = connect_queue()
+    retry_queue = RetryQueue(queue, redis.Redis(host='localhost', port=6379, db=0))
 
     # 加载提取规则
     extraction_rules = load_extraction_rules()
 
-    # 从 Redis 队列中获取 URL 并处理
-    while True:
+    # 从页面中发现的新链接批量加入同一个队列
+    link_discoverer = LinkDiscoverer(queue)
+
+    # 恢复上次运行的商品去重集合
+    if ITEM_ID_CHECKPOINT:
+        item_id.update(load_item_ids(ITEM_ID_CHECKPOINT))
+
+    try:
+        _worker_loop(queue, retry_queue, extraction_rules, link_discoverer)
+    finally:
+        if ITEM_ID_CHECKPOINT:
+            save_item_ids(item_id, ITEM_ID_CHECKPOINT)
+        if _connection_manager is not None:
+            _connection_manager.log_stats()
+        if _rate_controller is not None:
+            _rate_controller.unpublish()
+
+def _worker_loop(queue, retry_queue, extraction_rules, link_discoverer):
+    """
+    从 Redis 队列中获取 URL 并处理，失败的 URL 交给延迟重试队列
+    每个任务之间检查停止请求，收到后不再取新任务，正在进行的任务和重试任务的移动不会被打断
+    """
+    last_promote = 0.0
+    while not _stop_requested.is_set():
+        # 定期将到期的重试任务移回工作队列（也可单独运行 `python retry_queue.py mover`）
+        if time.time() - last_promote >= 1:
+            retry_queue.promote_due()
+            last_promote = time.time()
+
         task = queue.dequeue()
         if not task:
-            logging.info("No more URLs in the queue. Exiting...")
-            break
+            next_due = retry_queue.next_due_in()
+            if next_due is None:
+                logging.info("No more URLs in the queue. Exiting...")
+                break
+            # 工作队列为空，只剩等待中的重试任务
+            _stop_requested.wait(min(next_due, 1))
+            last_promote = 0.0
+            continue
         url = task['url']
+        depth = (task.get('metadata') or {}).get('depth', 0)
         logging.info(f"Processing URL: {url}")
-        result = process_url(url, extraction_rules)
+        try:
+            result = process_url(url, extraction_rules, depth, link_discoverer)
+        except FetchDeferred as e:
+            retry_queue.defer(task, e.delay)
+            continue
+        except FetchFailed as e:
+            retry_queue.schedule_retry(task, e.error_class, e, e.retry_after)
+            continue
         if result:
             logging.info("Cleaned data has been saved.")
             # 确认任务完成
@@ -287,3 +734,17 @@ if __name__ == "__main__":
             logging.info("No valid data was retrieved.")
         logging.info("-" * 50)
         logging.info("-" * 50)
+    if _stop_requested.is_set():
+        logging.info("Stop requested. Exiting...")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data extraction and cleaning worker")
+    parser.add_argument('command', nargs='?', default='worker', choices=['worker', 'setup'],
+                        help="'worker' processes URLs from the queue, 'setup' creates MongoDB indexes once")
+    args = parser.parse_args()
+
+    if args.command == 'setup':
+        setup_indexes()
+    else:
+        run_worker()
@@ -0,0 +1,210 @@
+# HTTP 连接池管理
+## 为抓取和状态上报提供线程安全的会话：连接池大小可按目标主机和代理分别配置，
+## 长时间空闲的连接池会被回收，并统计连接复用率。
+
+import time
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import InvalidURL, InvalidProxyURL
+from requests.utils import select_proxy, prepend_scheme_if_needed
+from urllib3.util import parse_url
+
+DEFAULT_POOL_SIZE = 10  # 每个目标主机的默认连接数上限
+DEFAULT_PROXY_POOL_SIZE = 10  # 每个代理的默认连接数上限
+IDLE_TIMEOUT = 60  # 连接池空闲多久后回收（秒）
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, manager):
+        """
+        按主机和代理设置连接池大小、记录最近使用时间的适配器
+        :param manager: 所属的 ConnectionManager
+        """
+        self.manager = manager
+        self.last_used = {}  # 主机名或代理 URL -> 最近使用时间
+        self.retired_connections = 0  # 已回收连接池中新建过的连接数
+        self.retired_requests = 0  # 已回收连接池中处理过的请求数
+        self._last_eviction = time.time()
+        super().__init__(pool_connections=manager.max_pools, pool_maxsize=manager.default_pool_size,
+                         pool_block=manager.pool_block)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pool_kwargs['maxsize'] = self.manager.pool_size_for(host_params['host'])
+        return host_params, pool_kwargs
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        proxy = select_proxy(request.url, proxies)
+        if not proxy:
+            return super().get_connection_with_tls_context(request, verify, proxies, cert)
+        # 经代理的请求按代理设置连接池大小；pool_kwargs 会覆盖 ProxyManager 创建时的 maxsize，
+        # 所以在这里设置，不修改适配器的共享属性，共享会话下也是线程安全的
+        try:
+            host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        except ValueError as e:
+            raise InvalidURL(e, request=request)
+        proxy = prepend_scheme_if_needed(proxy, 'http')
+        if not parse_url(proxy).host:
+            raise InvalidProxyURL("Please check proxy URL. It is malformed and could be missing the host.")
+        pool_kwargs['maxsize'] = self.manager.proxy_pool_size_for(proxy)
+        return self.proxy_manager_for(proxy).connection_from_host(**host_params, pool_kwargs=pool_kwargs)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        now = time.time()
+        self.last_used[urlsplit(request.url).hostname] = now
+        proxy = select_proxy(request.url, proxies)
+        if proxy:
+            self.last_used[prepend_scheme_if_needed(proxy, 'http')] = now
+        if now - self._last_eviction >= self.manager.idle_timeout / 2:
+            self.evict_idle(now)
+        return super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+
+    def _retire(self, pools, key):
+        try:
+            pool = pools[key]
+        except KeyError:
+            return
+        self.retired_connections += pool.num_connections
+        self.retired_requests += pool.num_requests
+        del pools[key]  # RecentlyUsedContainer 删除时会关闭连接池
+
+    def evict_idle(self, now=None):
+        """
+        回收空闲超过 idle_timeout 的主机连接池和代理连接池
+        :return: 回收的连接池数量
+        """
+        now = now or time.time()
+        self._last_eviction = now
+        deadline = now - self.manager.idle_timeout
+        evicted = 0
+        for key in list(self.poolmanager.pools.keys()):
+            if self.last_used.get(key.key_host, 0) < deadline:
+                self._retire(self.poolmanager.pools, key)
+                evicted += 1
+        for proxy in list(self.proxy_manager):
+            if self.last_used.get(proxy, 0) < deadline:
+                manager = self.proxy_manager.pop(proxy)
+                for key in list(manager.pools.keys()):
+                    self._retire(manager.pools, key)
+                manager.clear()
+                evicted += 1
+        for name in [name for name, used in self.last_used.items() if used < deadline]:
+            del self.last_used[name]
+        return evicted
+
+    def stats(self):
+        """
+        统计本适配器新建的连接数和处理的请求数
+        """
+        connections, requests_count, pools = self.retired_connections, self.retired_requests, 0
+        managers = [self.poolmanager] + list(self.proxy_manager.values())
+        for manager in managers:
+            for key in list(manager.pools.keys()):
+                try:
+                    pool = manager.pools[key]
+                except KeyError:
+                    continue
+                connections += pool.num_connections
+                requests_count += pool.num_requests
+                pools += 1
+        return {'connections': connections, 'requests': requests_count, 'pools': pools}
+
+
+class ConnectionManager:
+    def __init__(self, pool_sizes=None, proxy_pool_sizes=None, default_pool_size=DEFAULT_POOL_SIZE,
+                 default_proxy_pool_size=DEFAULT_PROXY_POOL_SIZE, max_pools=100, pool_block=False,
+                 idle_timeout=IDLE_TIMEOUT, thread_local=True):
+        """
+        HTTP 连接管理器
+        :param pool_sizes: {主机名: 连接数上限}，未列出的主机使用 default_pool_size
+        :param proxy_pool_sizes: {代理地址: 连接数上限}，代理地址形如 "http://1.2.3.4:8080"，未列出的使用 default_proxy_pool_size
+        :param default_pool_size: 每个目标主机的默认连接数上限
+        :param default_proxy_pool_size: 每个代理的默认连接数上限
+        :param max_pools: 每个会话最多缓存的主机连接池数量
+        :param pool_block: 连接池满时是否阻塞等待（否则新建临时连接并告警）
+        :param idle_timeout: 连接池空闲多久后回收（秒）
+        :param thread_local: 为 True 时每个线程使用独立会话；为 False 时所有线程共享一个会话（urllib3 连接池本身线程安全）
+        """
+        self.pool_sizes = dict(pool_sizes or {})
+        self.proxy_pool_sizes = {p.rstrip('/'): n for p, n in (proxy_pool_sizes or {}).items()}
+        self.default_pool_size = default_pool_size
+        self.default_proxy_pool_size = default_proxy_pool_size
+        self.max_pools = max_pools
+        self.pool_block = pool_block
+        self.idle_timeout = idle_timeout
+        self.thread_local = thread_local
+        self._local = threading.local()
+        self._shared = None
+        self._adapters = []
+        self._lock = threading.RLock()  # session() 持锁创建共享会话时会再次获取
+
+    def pool_size_for(self, host):
+        return self.pool_sizes.get(host, self.default_pool_size)
+
+    def proxy_pool_size_for(self, proxy):
+        return self.proxy_pool_sizes.get(proxy.rstrip('/'), self.default_proxy_pool_size)
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = PooledAdapter(self)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        with self._lock:
+            self._adapters.append(adapter)
+        return session
+
+    def session(self):
+        """
+        获取当前线程应使用的会话
+        """
+        if not self.thread_local:
+            if self._shared is None:
+                with self._lock:
+                    if self._shared is None:
+                        self._shared = self._new_session()
+            return self._shared
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._new_session()
+        return session
+
+    def evict_idle(self):
+        """
+        回收所有会话中空闲的连接池
+        :return: 回收的连接池数量
+        """
+        with self._lock:
+            adapters = list(self._adapters)
+        return sum(adapter.evict_idle() for adapter in adapters)
+
+    def stats(self):
+        """
+        连接复用统计：reuse_ratio 为复用已有连接的请求占比
+        """
+        with self._lock:
+            adapters = list(self._adapters)
+        totals = {'sessions': len(adapters), 'connections': 0, 'requests': 0, 'pools': 0}
+        for adapter in adapters:
+            for name, value in adapter.stats().items():
+                totals[name] += value
+        requests_count = totals['requests']
+        totals['reuse_ratio'] = 1 - totals['connections'] / requests_count if requests_count else 0.0
+        return totals
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"HTTP 连接复用率 {stats['reuse_ratio']:.1%}："
+                     f"{stats['requests']} 个请求，新建 {stats['connections']} 个连接，{stats['pools']} 个连接池")
+
+    def close(self):
+        """
+        关闭所有会话
+        """
+        with self._lock:
+            adapters, self._adapters = self._adapters, []
+        for adapter in adapters:
+            adapter.close()
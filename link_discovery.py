@@ -0,0 +1,182 @@
+# 链接发现
+## 从已解析的页面中提取外链，规范化 URL 并在进程内去重后批量写入 Redis 队列，
+## 避免因片段、跟踪参数、大小写、末尾斜杠等差异重复抓取同一页面。
+
+import logging
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+
+# 默认去除的查询参数（精确匹配）
+DEFAULT_STRIP_PARAMS = frozenset([
+    'spm', 'scm', 'tracelog', 'clickid', 'fbclid', 'gclid', 'msclkid', 'from', 'ref', 'share_crt_v',
+])
+# 默认去除的查询参数前缀
+DEFAULT_STRIP_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class URLCanonicalizer:
+    def __init__(self, strip_params=DEFAULT_STRIP_PARAMS, strip_prefixes=DEFAULT_STRIP_PREFIXES,
+                 sort_params=True):
+        """
+        URL 规范化器
+        :param strip_params: 需要去除的查询参数名集合
+        :param strip_prefixes: 需要去除的查询参数名前缀
+        :param sort_params: 是否对查询参数排序
+        """
+        self.strip_params = frozenset(p.lower() for p in strip_params)
+        self.strip_prefixes = tuple(p.lower() for p in strip_prefixes)
+        self.sort_params = sort_params
+
+    def _keep_param(self, name):
+        name = name.lower()
+        return name not in self.strip_params and not name.startswith(self.strip_prefixes)
+
+    def canonicalize(self, url, base_url=None):
+        """
+        规范化 URL：解析相对路径，小写协议和主机名，去除默认端口、片段、跟踪参数和末尾斜杠
+        :param url: 原始 URL（可以是相对路径）
+        :param base_url: 相对路径的基准 URL
+        :return: 规范化后的 URL，非 http(s) 链接返回 None
+        """
+        if base_url:
+            url = urljoin(base_url, url.strip())
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return None
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS or not parts.hostname:
+            return None
+
+        netloc = parts.hostname.rstrip('.')
+        if port and port != DEFAULT_PORTS[scheme]:
+            netloc = f"{netloc}:{port}"
+
+        path = parts.path or '/'
+        if len(path) > 1 and path.endswith('/'):
+            path = path.rstrip('/') or '/'
+
+        query = ''
+        if parts.query:
+            params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if self._keep_param(k)]
+            if self.sort_params:
+                params.sort()
+            query = urlencode(params)
+
+        return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def canonicalize_seed(url):
+    """
+    规范化种子 URL，使其与从页面中发现的同一链接一致
+    :return: 规范化后的 URL，非 http(s) 链接原样返回
+    """
+    return URLCanonicalizer().canonicalize(url) or url
+
+
+class RecentlySeenFilter:
+    def __init__(self, capacity=100000):
+        """
+        进程内最近访问过的 URL 过滤器（LRU），在写入 Redis 之前丢弃重复链接
+        :param capacity: 最多记住的 URL 数量
+        """
+        self.capacity = capacity
+        self._seen = OrderedDict()
+
+    def add(self, url):
+        """
+        记录 URL
+        :return: URL 是否是第一次出现
+        """
+        if url in self._seen:
+            self._seen.move_to_end(url)
+            return False
+        self._seen[url] = None
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class LinkDiscoverer:
+    def __init__(self, queue, max_depth=2, allowed_domains=None, canonicalizer=None,
+                 seen_capacity=100000, batch_size=500):
+        """
+        外链发现并批量加入队列
+        :param queue: RedisURLQueue 或 ShardedURLQueue 实例
+        :param max_depth: 最大抓取深度，种子 URL 的深度为 0
+        :param allowed_domains: 允许抓取的域名列表（包含子域名），为 None 时只跟随与来源页面相同主机的链接
+        :param canonicalizer: URLCanonicalizer 实例
+        :param seen_capacity: 进程内去重过滤器容量
+        :param batch_size: 每次 pipeline 写入的最大链接数
+        """
+        self.queue = queue
+        self.max_depth = max_depth
+        self.allowed_domains = tuple(d.lower().lstrip('.') for d in allowed_domains) if allowed_domains else None
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.seen = RecentlySeenFilter(seen_capacity)
+        self.batch_size = batch_size
+
+    def in_scope(self, url, source_url):
+        """
+        判断链接是否在抓取范围内
+        """
+        host = urlsplit(url).hostname or ''
+        if self.allowed_domains is None:
+            return host == (urlsplit(source_url).hostname or '')
+        return any(host == d or host.endswith('.' + d) for d in self.allowed_domains)
+
+    def extract_links(self, soup, base_url):
+        """
+        从已解析的文档中提取规范化后的外链
+        :param soup: BeautifulSoup 文档
+        :param base_url: 页面 URL
+        :return: 规范化后的 URL 列表（保持出现顺序，已去除页面内重复）
+        """
+        base_tag = soup.find('base', href=True)
+        if base_tag:
+            base_url = urljoin(base_url, base_tag['href'])
+        links = []
+        page_seen = set()
+        for tag in soup.find_all('a', href=True):
+            if 'nofollow' in (tag.get('rel') or []):
+                continue
+            url = self.canonicalizer.canonicalize(tag['href'], base_url)
+            if url and url not in page_seen:
+                page_seen.add(url)
+                links.append(url)
+        return links
+
+    def discover(self, soup, source_url, depth=0):
+        """
+        提取页面外链，过滤后批量加入队列
+        :param soup: BeautifulSoup 文档
+        :param source_url: 页面 URL
+        :param depth: 页面的抓取深度
+        :return: 新加入队列的链接数量
+        """
+        # 正在抓取的页面本身也记为已发现，页面中指向自身的链接不会让它再次入队
+        source = self.canonicalizer.canonicalize(source_url) or source_url
+        if self.seen.add(source):
+            self.queue.mark_discovered([source])
+        if depth >= self.max_depth:
+            return 0
+        metadata = {'depth': depth + 1, 'parent': source_url}
+        batch = []
+        added = 0
+        for url in self.extract_links(soup, source_url):
+            if not self.in_scope(url, source_url) or not self.seen.add(url):
+                continue
+            batch.append((url, metadata))
+            if len(batch) >= self.batch_size:
+                added += self.queue.enqueue_batch_with_dedup(batch)
+                batch = []
+        if batch:
+            added += self.queue.enqueue_batch_with_dedup(batch)
+        if added:
+            logging.info(f"从 {source_url} 发现 {added} 个新链接")
+        return added
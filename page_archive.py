@@ -0,0 +1,244 @@
+# 原始页面归档
+## 将抓取到的原始 HTML/JSON 按内容哈希去重后追加写入 zstd 压缩的 WARC 风格分段文件，
+## 修改提取规则后可直接从归档重放提取，无需重新通过代理抓取。
+
+import os
+import mmap
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from multiprocessing import Pool
+
+import zstandard as zstd
+
+SEGMENT_MAX_BYTES = 1024 * 1024 * 1024  # 单个分段文件的最大字节数，超过后滚动到新分段
+ZSTD_LEVEL = 3  # zstd 压缩级别
+INDEX_FILE = 'index.sqlite3'
+
+
+class PageArchive:
+    def __init__(self, archive_dir='page_archive', segment_max_bytes=SEGMENT_MAX_BYTES, level=ZSTD_LEVEL):
+        """
+        打开（或创建）页面归档目录
+        :param archive_dir: 归档目录，包含分段文件和 URL 索引
+        :param segment_max_bytes: 单个分段文件的最大字节数
+        :param level: zstd 压缩级别
+        """
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(archive_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._compressor = zstd.ZstdCompressor(level=level)
+        self._decompressor = zstd.ZstdDecompressor()
+        self._mmaps = {}  # 分段编号 -> mmap，用于随机读取
+        # 自动提交模式，写入时显式 BEGIN IMMEDIATE；多个工作进程共用一个归档目录时由该写锁串行化追加
+        self._index = sqlite3.connect(os.path.join(archive_dir, INDEX_FILE), timeout=60,
+                                      check_same_thread=False, isolation_level=None)
+        self._index.execute('PRAGMA journal_mode=WAL')
+        self._index.execute(
+            'CREATE TABLE IF NOT EXISTS payloads '
+            '(digest TEXT PRIMARY KEY, segment INTEGER, offset INTEGER, length INTEGER)'
+        )
+        self._index.execute(
+            'CREATE TABLE IF NOT EXISTS pages '
+            '(url TEXT PRIMARY KEY, digest TEXT, content_type TEXT, encoding TEXT, fetched_at REAL)'
+        )
+        row = self._index.execute('SELECT MAX(segment) FROM payloads').fetchone()
+        self._segment = row[0] or 0
+
+    def _segment_path(self, segment):
+        return os.path.join(self.archive_dir, f"segment-{segment:05d}.warc.zst")
+
+    def put(self, url, body, content_type='', encoding=None):
+        """
+        归档一个页面，相同内容只存储一次
+        :param url: 页面 URL
+        :param body: 原始响应体字节
+        :param content_type: 响应的 Content-Type
+        :param encoding: 探测到的字符集
+        :return: 响应体的 sha256 摘要
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        header = (
+            "WARC/1.0\r\n"
+            "WARC-Type: resource\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            f"WARC-Date: {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}\r\n"
+            f"WARC-Payload-Digest: sha256:{digest}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode('utf-8')
+        with self._lock:
+            # 持有数据库写锁期间完成查重、追加和登记，其他进程的 put 在 BEGIN IMMEDIATE 处等待
+            self._index.execute('BEGIN IMMEDIATE')
+            try:
+                exists = self._index.execute('SELECT 1 FROM payloads WHERE digest = ?', (digest,)).fetchone()
+                if not exists:
+                    # 每条记录独立压缩成一个 zstd 帧，便于按偏移随机读取
+                    frame = self._compressor.compress(header + body + b"\r\n\r\n")
+                    segment, offset = self._append(frame)
+                    self._index.execute(
+                        'INSERT OR IGNORE INTO payloads VALUES (?, ?, ?, ?)', (digest, segment, offset, len(frame))
+                    )
+                self._index.execute(
+                    'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                    (url, digest, content_type, encoding, time.time())
+                )
+                self._index.execute('COMMIT')
+            except BaseException:
+                self._index.execute('ROLLBACK')
+                raise
+        return digest
+
+    def _append(self, frame):
+        """
+        将一帧追加到当前分段，需在数据库写锁内调用
+        :return: (分段编号, 帧的起始偏移)
+        """
+        # 其他进程可能已经滚动到新分段
+        row = self._index.execute('SELECT MAX(segment) FROM payloads').fetchone()
+        self._segment = max(self._segment, row[0] or 0)
+        path = self._segment_path(self._segment)
+        if os.path.exists(path) and os.path.getsize(path) + len(frame) > self.segment_max_bytes:
+            self._segment += 1
+            path = self._segment_path(self._segment)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = 0
+            while written < len(frame):
+                written += os.write(fd, frame[written:])
+            # 偏移取追加之后的文件大小减去帧长，不依赖写入前的 tell()
+            offset = os.fstat(fd).st_size - len(frame)
+        finally:
+            os.close(fd)
+        return self._segment, offset
+
+    def _read_frame(self, segment, offset, length):
+        mm = self._mmaps.get(segment)
+        if mm is None or offset + length > len(mm):
+            # 当前写入中的分段会继续增长，读取越界时重新映射
+            if mm is not None:
+                mm.close()
+            with open(self._segment_path(segment), 'rb') as segment_file:
+                mm = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmaps[segment] = mm
+        return mm[offset:offset + length]
+
+    def get(self, url):
+        """
+        读取归档的页面
+        :param url: 页面 URL
+        :return: (body, encoding, content_type)，未归档时返回 None
+        """
+        with self._lock:
+            row = self._index.execute(
+                'SELECT p.segment, p.offset, p.length, u.encoding, u.content_type '
+                'FROM pages u JOIN payloads p ON u.digest = p.digest WHERE u.url = ?', (url,)
+            ).fetchone()
+            if not row:
+                return None
+            segment, offset, length, encoding, content_type = row
+            record = self._decompressor.decompress(self._read_frame(segment, offset, length))
+        header, _, rest = record.partition(b"\r\n\r\n")
+        content_length = 0
+        for line in header.split(b"\r\n"):
+            if line.lower().startswith(b"content-length:"):
+                content_length = int(line.split(b":", 1)[1])
+        return rest[:content_length], encoding, content_type
+
+    def iter_urls(self):
+        """
+        遍历所有已归档的 URL，按内容摘要排序以提高读取局部性
+        """
+        with self._lock:
+            rows = self._index.execute('SELECT url FROM pages ORDER BY digest').fetchall()
+        for (url,) in rows:
+            yield url
+
+    def size(self):
+        """
+        获取已归档的 URL 数量
+        """
+        with self._lock:
+            return self._index.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def close(self):
+        """
+        关闭索引和所有内存映射
+        """
+        with self._lock:
+            for mm in self._mmaps.values():
+                mm.close()
+            self._mmaps.clear()
+            self._index.close()
+
+
+_worker_archive = None
+_worker_rules = None
+
+
+def _init_reextract_worker(archive_dir):
+    global _worker_archive, _worker_rules
+    import data_extraction_and_cleaning
+    _worker_archive = PageArchive(archive_dir)
+    _worker_rules = data_extraction_and_cleaning.load_extraction_rules()
+
+
+def _reextract_url(url):
+    import data_extraction_and_cleaning as dec
+    try:
+        page = dec.decode_page(dec.RawPage(*_worker_archive.get(url)))
+        cleaned_data = dec.clean_data(dec.extract_data(page, url, _worker_rules))
+        if cleaned_data:
+            dec.store_cleaned_data(cleaned_data, url, replace=True)
+        return len(cleaned_data)
+    except Exception as e:
+        logging.error(f"重新提取 {url} 时出现错误: {e}")
+        return 0
+
+
+def reextract(archive_dir='page_archive', workers=4):
+    """
+    用当前的提取规则并行重放归档中的所有页面
+    商品按标题覆盖写入而不是追加，重放结束后从商品集合重算汇总，重复重放结果不变
+    :param archive_dir: 归档目录
+    :param workers: 工作进程数量
+    :return: (处理的页面数, 提取的记录数)
+    """
+    archive = PageArchive(archive_dir)
+    urls = list(archive.iter_urls())
+    archive.close()
+    pages = records = 0
+    with Pool(workers, initializer=_init_reextract_worker, initargs=(archive_dir,)) as pool:
+        for count in pool.imap_unordered(_reextract_url, urls, chunksize=64):
+            pages += 1
+            records += count
+    logging.info(f"重新提取完成: {pages} 个页面，{records} 条记录")
+    if records:
+        import data_extraction_and_cleaning as dec
+        from product_aggregates import rebuild
+        rebuild(dec.MONGO_URI, dec.MONGO_DB, dec.MONGO_TABLE, workers, redis_client=dec.get_redis())
+    return pages, records
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Raw page archive")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    reextract_parser = subparsers.add_parser('reextract', help='Replay archived pages through the current extraction rules')
+    reextract_parser.add_argument('--archive_dir', type=str, default='page_archive', help='Archive directory')
+    reextract_parser.add_argument('--workers', type=int, default=4, help='Number of worker processes')
+    stats_parser = subparsers.add_parser('stats', help='Show archive statistics')
+    stats_parser.add_argument('--archive_dir', type=str, default='page_archive', help='Archive directory')
+    args = parser.parse_args()
+
+    if args.command == 'reextract':
+        reextract(args.archive_dir, args.workers)
+    else:
+        archive = PageArchive(args.archive_dir)
+        print("Archived URLs:", archive.size())
+        archive.close()
@@ -0,0 +1,349 @@
+# 1688 商品数据增量聚合
+## 每批商品入库时同步更新物化汇总（按省份、城市、公司类型的数量、价格最小/平均/最大值和销量，
+## 以及按公司的销量排行），查询接口按主键读取汇总文档，无需扫描整个集合。
+## 修改聚合口径后可用 `python product_aggregates.py rebuild` 按 _id 分段并行重算。
+## 重算期间入库的商品带有 _rollup_pending 标记且 _id 记入 Redis 日志，重算扫描跳过它们，换入新汇总后再补记，增量不会丢失。
+
+import re
+import time
+import logging
+import argparse
+from multiprocessing import Pool
+
+import pymongo
+from bson import ObjectId
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+
+# 维度名 -> 商品字段
+DIMENSIONS = {
+    'province': '省份',
+    'city': '城市',
+    'company_type': '公司类型',
+    'company': '公司',
+}
+ALL = 'all'  # 全量汇总的维度名
+SUM_FIELDS = ('count', 'price_count', 'price_sum', 'wholesale_count', 'wholesale_sum', 'sales_sum')
+PAUSE_GRACE = 5  # 设置暂停标记后等待进行中的增量更新完成的时间（秒）
+
+REBUILDING_KEY = 'rollups_rebuilding:{}'  # 重算进行中的标记
+PENDING_KEY = 'rollups_pending:{}'  # 重算期间入库商品的 _id 日志
+PENDING_FIELD = '_rollup_pending'  # 重算期间入库的商品上的标记，重算扫描跳过带标记的商品，补记后移除
+
+# 重算进行中时把 _id 写入日志并返回 1，否则返回 0，由调用方在入库后直接更新汇总
+_JOURNAL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV))
+    return 1
+end
+return 0
+"""
+
+# 原子地结束暂停并取出日志，此后的写入直接更新新汇总
+_DRAIN_SCRIPT = """
+redis.call('DEL', KEYS[1])
+local ids = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[2])
+return ids
+"""
+
+
+def rollup_collection_name(table):
+    """
+    汇总集合名称
+    """
+    return f"{table}_rollups"
+
+
+def _to_number(value):
+    """
+    将价格、销量转换为数字，支持 "1.2万"、"300+" 之类的写法，无法解析时返回 None
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    match = re.search(r'\d+(?:\.\d+)?', value.replace(',', ''))
+    if not match:
+        return None
+    number = float(match.group())
+    if '万' in value:
+        number *= 10000
+    return number
+
+
+def _new_accumulator():
+    return {'count': 0, 'price_count': 0, 'price_sum': 0.0, 'price_min': None, 'price_max': None,
+            'wholesale_count': 0, 'wholesale_sum': 0.0, 'wholesale_min': None, 'wholesale_max': None,
+            'sales_sum': 0.0}
+
+
+def _merge_min(a, b):
+    return b if a is None else (a if b is None else min(a, b))
+
+
+def _merge_max(a, b):
+    return b if a is None else (a if b is None else max(a, b))
+
+
+def merge_accumulators(target, source):
+    """
+    合并两组汇总（原地修改 target）
+    :param target: {汇总 _id: 累加器}
+    :param source: {汇总 _id: 累加器}
+    :return: target
+    """
+    for key, acc in source.items():
+        dest = target.setdefault(key, _new_accumulator())
+        for field in SUM_FIELDS:
+            dest[field] += acc[field]
+        for field in ('price_min', 'wholesale_min'):
+            dest[field] = _merge_min(dest[field], acc[field])
+        for field in ('price_max', 'wholesale_max'):
+            dest[field] = _merge_max(dest[field], acc[field])
+    return target
+
+
+def rollup_batch(items):
+    """
+    计算一批商品的汇总增量
+    :param items: 清洗后的商品字典列表
+    :return: {汇总 _id: 累加器}，_id 形如 "province:浙江"
+    """
+    accumulators = {}
+    for item in items:
+        price = _to_number(item.get('原价'))
+        wholesale = _to_number(item.get('最低批发价'))
+        sales = _to_number(item.get('销售量')) or 0.0
+        keys = [f"{ALL}:{ALL}"]
+        for dimension, field in DIMENSIONS.items():
+            value = item.get(field)
+            if value:
+                keys.append(f"{dimension}:{value}")
+        for key in keys:
+            acc = accumulators.setdefault(key, _new_accumulator())
+            acc['count'] += 1
+            acc['sales_sum'] += sales
+            if price is not None:
+                acc['price_count'] += 1
+                acc['price_sum'] += price
+                acc['price_min'] = _merge_min(acc['price_min'], price)
+                acc['price_max'] = _merge_max(acc['price_max'], price)
+            if wholesale is not None:
+                acc['wholesale_count'] += 1
+                acc['wholesale_sum'] += wholesale
+                acc['wholesale_min'] = _merge_min(acc['wholesale_min'], wholesale)
+                acc['wholesale_max'] = _merge_max(acc['wholesale_max'], wholesale)
+    return accumulators
+
+
+def apply_rollups(rollups, accumulators):
+    """
+    将汇总增量写入汇总集合（$inc/$min/$max，批量 upsert）
+    :param rollups: 汇总集合
+    :param accumulators: rollup_batch 的结果
+    """
+    operations = []
+    for key, acc in accumulators.items():
+        dimension, _, value = key.partition(':')
+        update = {
+            '$setOnInsert': {'dimension': dimension, 'value': value},
+            '$inc': {field: acc[field] for field in SUM_FIELDS},
+        }
+        mins = {field: acc[field] for field in ('price_min', 'wholesale_min') if acc[field] is not None}
+        maxs = {field: acc[field] for field in ('price_max', 'wholesale_max') if acc[field] is not None}
+        if mins:
+            update['$min'] = mins
+        if maxs:
+            update['$max'] = maxs
+        operations.append(UpdateOne({'_id': key}, update, upsert=True))
+    if operations:
+        rollups.bulk_write(operations, ordered=False)
+
+
+def pause_if_rebuilding(redis_client, table, items):
+    """
+    商品入库前调用：重算进行中时为商品预先分配 _id、打上 PENDING_FIELD 标记并把 _id 记入日志，
+    这些商品不会被重算扫描，由重算在换入新汇总后补记
+    :param redis_client: 检查重算标记的 Redis 客户端，为 None 时不检查
+    :param table: 商品集合名称
+    :param items: 即将入库的商品字典列表
+    :return: 是否处于暂停状态（为 True 时入库后不要调用 update_aggregates）
+    """
+    if redis_client is None or not items:
+        return False
+    for item in items:
+        item.setdefault('_id', ObjectId())
+    ids = [str(item['_id']) for item in items]
+    if not redis_client.eval(_JOURNAL_SCRIPT, 2, REBUILDING_KEY.format(table), PENDING_KEY.format(table), *ids):
+        return False
+    for item in items:
+        item[PENDING_FIELD] = True
+    return True
+
+
+def update_aggregates(db, table, items):
+    """
+    商品入库后调用，增量更新汇总
+    :param db: MongoDB 数据库
+    :param table: 商品集合名称
+    :param items: 本批成功入库的商品字典列表
+    """
+    apply_rollups(db[rollup_collection_name(table)], rollup_batch(items))
+
+
+def ensure_indexes(db, table):
+    """
+    创建汇总集合的索引（维度 + 销量，用于销量排行）
+    """
+    db[rollup_collection_name(table)].create_index([('dimension', ASCENDING), ('sales_sum', DESCENDING)])
+
+
+def format_rollup(doc):
+    """
+    将汇总文档转换为接口输出格式，计算平均值
+    """
+    # 平均值只计入价格解析成功的商品
+    price_count = doc.get('price_count') or 0
+    wholesale_count = doc.get('wholesale_count') or 0
+    return {
+        'dimension': doc['dimension'],
+        'value': doc['value'],
+        'count': doc.get('count') or 0,
+        'price': {'min': doc.get('price_min'), 'max': doc.get('price_max'),
+                  'avg': doc.get('price_sum', 0) / price_count if price_count else None},
+        'wholesale_price': {'min': doc.get('wholesale_min'), 'max': doc.get('wholesale_max'),
+                            'avg': doc.get('wholesale_sum', 0) / wholesale_count if wholesale_count else None},
+        'sales': doc.get('sales_sum', 0),
+    }
+
+
+def get_rollup(db, table, dimension, value=ALL):
+    """
+    按主键读取一个汇总
+    """
+    doc = db[rollup_collection_name(table)].find_one({'_id': f"{dimension}:{value}"})
+    return format_rollup(doc) if doc else None
+
+
+def get_dimension(db, table, dimension, limit=100):
+    """
+    读取一个维度下的所有汇总，按销量降序（走 dimension + sales_sum 索引）
+    """
+    cursor = db[rollup_collection_name(table)].find({'dimension': dimension}).sort('sales_sum', DESCENDING).limit(limit)
+    return [format_rollup(doc) for doc in cursor]
+
+
+def top_sellers(db, table, n=10):
+    """
+    销量排行前 n 的公司
+    """
+    return get_dimension(db, table, 'company', limit=n)
+
+
+def _rebuild_chunk(args):
+    mongo_uri, db_name, table, lower, upper, last = args
+    client = pymongo.MongoClient(mongo_uri)
+    try:
+        # 重算期间入库的商品由日志补记，这里跳过
+        query = {'_id': {'$gte': lower, '$lte' if last else '$lt': upper}, PENDING_FIELD: {'$exists': False}}
+        projection = {field: 1 for field in ('原价', '最低批发价', '销售量', *DIMENSIONS.values())}
+        accumulators = {}
+        batch = []
+        for doc in client[db_name][table].find(query, projection, batch_size=5000):
+            batch.append(doc)
+            if len(batch) >= 5000:
+                merge_accumulators(accumulators, rollup_batch(batch))
+                batch = []
+        merge_accumulators(accumulators, rollup_batch(batch))
+        return accumulators
+    finally:
+        client.close()
+
+
+def rebuild(mongo_uri, db_name, table, workers=4, chunks=None, redis_client=None):
+    """
+    从商品集合重新计算全部汇总：按 _id 分段并行计算，合并后替换汇总集合
+    提供 redis_client 时，重算期间入库的商品带标记并记入日志，扫描跳过它们，换入新汇总后全部补记；
+    不提供时重算期间的增量更新会随旧汇总一起被替换，应先停止入库
+    :param mongo_uri: MongoDB 连接串
+    :param db_name: 数据库名称
+    :param table: 商品集合名称
+    :param workers: 工作进程数量
+    :param chunks: 分段数量，默认为工作进程数的 4 倍
+    :param redis_client: 入库端（save_to_mongo）使用的 Redis
+    :return: 汇总文档数量
+    """
+    client = pymongo.MongoClient(mongo_uri)
+    db = client[db_name]
+    name = rollup_collection_name(table)
+    if redis_client is not None:
+        # 上次重算中断时残留的标记和日志：这些商品没有补记过，清除标记后由本次扫描计入
+        redis_client.delete(PENDING_KEY.format(table))
+        db[table].update_many({PENDING_FIELD: {'$exists': True}}, {'$unset': {PENDING_FIELD: ''}})
+        redis_client.set(REBUILDING_KEY.format(table), 1, ex=24 * 3600)
+        time.sleep(PAUSE_GRACE)  # 等待检查标记之前已开始的入库完成，它们的商品已在集合中，会被扫描到
+    else:
+        logging.warning("未提供 Redis，重算期间入库的增量更新将会丢失")
+    try:
+        buckets = list(db[table].aggregate([
+            {'$bucketAuto': {'groupBy': '$_id', 'buckets': chunks or workers * 4}}
+        ]))
+        tasks = [(mongo_uri, db_name, table, b['_id']['min'], b['_id']['max'], i == len(buckets) - 1)
+                 for i, b in enumerate(buckets)]
+
+        accumulators = {}
+        with Pool(workers) as pool:
+            for partial in pool.imap_unordered(_rebuild_chunk, tasks):
+                merge_accumulators(accumulators, partial)
+
+        # 先写入临时集合再整体替换，重算期间查询仍读到旧汇总
+        db[name + '_rebuild'].drop()
+        if accumulators:
+            apply_rollups(db[name + '_rebuild'], accumulators)
+            db[name + '_rebuild'].rename(name, dropTarget=True)
+        else:
+            db[name].drop()
+        ensure_indexes(db, table)
+    finally:
+        # 成功时补记到新汇总；失败时旧汇总仍在使用，同样补记到旧汇总
+        if redis_client is not None:
+            _apply_pending(db, table, redis_client)
+        client.close()
+
+    logging.info(f"汇总重算完成: {len(buckets)} 个分段，{len(accumulators)} 个汇总文档")
+    return len(accumulators)
+
+
+def _apply_pending(db, table, redis_client):
+    """
+    结束暂停，将日志中的商品全部计入当前汇总并移除其标记
+    """
+    ids = redis_client.eval(_DRAIN_SCRIPT, 2, REBUILDING_KEY.format(table), PENDING_KEY.format(table))
+    if not ids:
+        return
+    ids = [ObjectId(i.decode() if isinstance(i, bytes) else i) for i in ids]
+    projection = {field: 1 for field in ('原价', '最低批发价', '销售量', *DIMENSIONS.values())}
+    for start in range(0, len(ids), 5000):
+        # 只补记仍带标记的商品：插入失败的 _id 不存在，已补记的标记已移除
+        query = {'_id': {'$in': ids[start:start + 5000]}, PENDING_FIELD: True}
+        pending = list(db[table].find(query, projection))
+        apply_rollups(db[rollup_collection_name(table)], rollup_batch(pending))
+        db[table].update_many({'_id': {'$in': [doc['_id'] for doc in pending]}}, {'$unset': {PENDING_FIELD: ''}})
+        logging.info(f"补记重算期间入库的商品 {len(pending)} 个")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="1688 product aggregates")
+    parser.add_argument('command', choices=['rebuild'], help='Recompute all aggregates from the collection')
+    parser.add_argument('--mongo_uri', type=str, default='mongodb://localhost:27017/', help='MongoDB URI')
+    parser.add_argument('--db', type=str, default='web_crawler', help='Database name')
+    parser.add_argument('--table', type=str, default='scraped_data', help='Product collection name')
+    parser.add_argument('--workers', type=int, default=4, help='Number of worker processes')
+    parser.add_argument('--redis_host', type=str, default='localhost', help='Redis used by the ingest side to pause increments')
+    parser.add_argument('--redis_port', type=int, default=6379, help='Redis server port')
+    args = parser.parse_args()
+
+    import redis
+    rebuild(args.mongo_uri, args.db, args.table, args.workers,
+            redis_client=redis.Redis(host=args.redis_host, port=args.redis_port, db=0))
@@ -1,21 +1,33 @@
 from flask import Flask, request, jsonify
 import pymongo
+import redis
+from result_cache import ResultCache
+import product_aggregates
+from config import MONGO_URI, MONGO_DB, MONGO_TABLE
 
 app = Flask(__name__)
 
-# 连接 MongoDB
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["web_crawler"]
-collection = db["scraped_data"]
+# 连接 MongoDB，与抓取端（data_extraction_and_cleaning.py）使用同一份配置
+client = pymongo.MongoClient(MONGO_URI)
+db = client[MONGO_DB]
+collection = db[MONGO_TABLE]
+
+# 查询结果缓存：进程内 LRU + Redis 共享缓存，存储端写入 MONGO_TABLE 后递增其版本号使旧结果失效
+cache = ResultCache(MONGO_TABLE, redis_client=redis.Redis(host='localhost', port=6379, db=0), ttl=60)
 
 @app.route('/search', methods=['GET'])
 def search_data():
     """
     按关键词搜索数据
     """
+    # 关键词作为正则表达式原样交给 MongoDB：首尾空格和大小写都会改变匹配结果，缓存键同样保留原样
     query = request.args.get('query', '')
-    results = collection.find({"title": {"$regex": query, "$options": "i"}}).limit(10)
-    return jsonify([{"title": item["title"], "url": item["url"]} for item in results])
+
+    def compute():
+        results = collection.find({"title": {"$regex": query, "$options": "i"}}).limit(10)
+        return [{"title": item["title"], "url": item["url"]} for item in results]
+
+    return jsonify(cache.get_or_compute('search', {'query': query}, compute, verbatim=('query',)))
 
 @app.route('/get', methods=['GET'])
 def get_data():
@@ -26,8 +38,43 @@ def get_data():
     per_page = 10
     skip = (page - 1) * per_page
 
-    results = collection.find().skip(skip).limit(per_page)
-    return jsonify([{"title": item["title"], "url": item["url"]} for item in results])
+    def compute():
+        results = collection.find().skip(skip).limit(per_page)
+        return [{"title": item["title"], "url": item["url"]} for item in results]
+
+    return jsonify(cache.get_or_compute('get', {'page': page, 'per_page': per_page}, compute))
+
+@app.route('/aggregates/<dimension>', methods=['GET'])
+def get_aggregates(dimension):
+    """
+    读取商品汇总（province、city、company_type、company 或 all），可选参数 value 只返回指定分组
+    汇总在入库时增量维护，按主键或索引读取，不扫描商品集合
+    """
+    if dimension != product_aggregates.ALL and dimension not in product_aggregates.DIMENSIONS:
+        return jsonify({"error": f"unknown dimension: {dimension}"}), 404
+    value = request.args.get('value')
+    if dimension == product_aggregates.ALL or value:
+        result = product_aggregates.get_rollup(db, collection.name, dimension, value or product_aggregates.ALL)
+        if result is None:
+            return jsonify({"error": "not found"}), 404
+        return jsonify(result)
+    limit = int(request.args.get('limit', 100))
+    return jsonify(product_aggregates.get_dimension(db, collection.name, dimension, limit))
+
+@app.route('/top_sellers', methods=['GET'])
+def get_top_sellers():
+    """
+    销量排行前 n 的公司
+    """
+    n = int(request.args.get('n', 10))
+    return jsonify(product_aggregates.top_sellers(db, collection.name, n))
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    查看查询缓存命中率
+    """
+    return jsonify(cache.get_stats())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
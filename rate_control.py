@@ -0,0 +1,421 @@
+# 自适应限速
+## 按主机跟踪延迟和错误率，用 AIMD（加性增、乘性减）调整每个主机允许的并发数和请求速率，
+## 遇到 429/503 立即减半并遵守 Retry-After，健康且响应快的主机逐步提速。
+## 提供 Redis 客户端时，各主机的限制、发送间隔和在途请求数保存在 Redis 中，由 Lua 脚本原子地申请和归还许可，
+## 所有工作进程共同遵守同一组限制，而不是每个进程各自按限制发送。
+
+import os
+import json
+import time
+import socket
+import itertools
+import threading
+import email.utils
+
+HOST_LIMITS_KEY = 'crawler_host_limits'  # 监控 API 读取的 Redis 哈希，字段为 "工作进程|主机"
+HOST_LIMITS_MAX_AGE = 60  # 超过该时间（秒）未更新的字段视为已退出的工作进程，予以清理
+HOST_STATE_KEY = 'crawler_host_state'  # 所有工作进程共享的各主机限速状态，字段为 "主机|名称"，随检查点保存
+HOST_LEASES_KEY = 'crawler_host_leases'  # "crawler_host_leases:主机" 有序集合：在途请求的许可及其过期时间
+PERMIT_LEASE = 60  # 许可的租期（秒），持有许可的工作进程崩溃后，许可到期自动失效
+THROTTLE_STATUS = (429, 503)  # 表示被限流的状态码
+
+# 申请许可：清理过期租约，并发数、发送间隔和 Retry-After 都允许时登记租约并推进下一次发送时间
+# KEYS: 状态哈希, 租约有序集合  ARGV: 主机, 许可标识, 当前时间, 租期, 初始并发数, 初始速率
+# 返回需要等待的秒数（字符串），"0" 表示已获得许可
+_ACQUIRE_SCRIPT = """
+local host = ARGV[1]
+local now = tonumber(ARGV[3])
+local v = redis.call('HMGET', KEYS[1], host .. '|concurrency', host .. '|rate', host .. '|next_send',
+                     host .. '|blocked_until')
+local concurrency = tonumber(v[1]) or tonumber(ARGV[5])
+local rate = tonumber(v[2]) or tonumber(ARGV[6])
+local next_send = tonumber(v[3]) or 0
+local wait = math.max(tonumber(v[4]) or 0, next_send) - now
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+if redis.call('ZCARD', KEYS[2]) >= math.max(1, math.floor(concurrency)) then
+    wait = math.max(wait, 0.05)
+end
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[4]), ARGV[2])
+redis.call('HSET', KEYS[1], host .. '|next_send', tostring(math.max(now, next_send) + 1 / rate))
+return '0'
+"""
+
+# 归还许可并按请求结果做 AIMD 调整，与 AdaptiveRateController._adjust 的计算相同
+# KEYS: 状态哈希, 租约有序集合
+# ARGV: 主机, 许可标识, 当前时间, 延迟（"" 表示无）, 是否失败（1/0）, Retry-After 等待秒数（"" 表示无），
+#       初始并发数, 初始速率, 最大并发数, 最小速率, 最大速率, 加性增量, 乘性减小系数, 目标延迟, 平滑系数,
+#       减速冷却时间（"" 表示取当前延迟）
+# 返回 {并发数, 速率, 延迟, 错误率, Retry-After 截止时间, 请求数, 错误数}
+_RELEASE_SCRIPT = """
+local host = ARGV[1]
+local now = tonumber(ARGV[3])
+redis.call('ZREM', KEYS[2], ARGV[2])
+local v = redis.call('HMGET', KEYS[1], host .. '|concurrency', host .. '|rate', host .. '|latency',
+                     host .. '|error_rate', host .. '|last_decrease', host .. '|blocked_until',
+                     host .. '|requests', host .. '|errors')
+local concurrency = tonumber(v[1]) or tonumber(ARGV[7])
+local rate = tonumber(v[2]) or tonumber(ARGV[8])
+local latency = tonumber(v[3])
+local error_rate = tonumber(v[4]) or 0
+local last_decrease = tonumber(v[5]) or 0
+local blocked_until = tonumber(v[6]) or 0
+local requests = (tonumber(v[7]) or 0) + 1
+local errors = tonumber(v[8]) or 0
+local alpha = tonumber(ARGV[15])
+local sample = tonumber(ARGV[4])
+if sample then
+    if latency then
+        latency = alpha * sample + (1 - alpha) * latency
+    else
+        latency = sample
+    end
+end
+local failed = ARGV[5] == '1'
+error_rate = alpha * (failed and 1 or 0) + (1 - alpha) * error_rate
+if failed then
+    errors = errors + 1
+end
+local delay = tonumber(ARGV[6])
+if delay and delay > 0 then
+    blocked_until = math.max(blocked_until, now + delay)
+end
+if failed or (latency and latency > tonumber(ARGV[14])) then
+    local cooldown = tonumber(ARGV[16])
+    if not cooldown then
+        cooldown = (latency and latency > 0) and latency or 1.0
+    end
+    if now - last_decrease >= cooldown then
+        concurrency = math.max(1, concurrency * tonumber(ARGV[13]))
+        rate = math.max(tonumber(ARGV[10]), rate * tonumber(ARGV[13]))
+        last_decrease = now
+    end
+else
+    concurrency = math.min(tonumber(ARGV[9]), concurrency + tonumber(ARGV[12]) / concurrency)
+    rate = math.min(tonumber(ARGV[11]), rate + tonumber(ARGV[12]) / math.max(1, concurrency))
+end
+local result = {tostring(concurrency), tostring(rate), latency and tostring(latency) or '', tostring(error_rate),
+                tostring(blocked_until), tostring(requests), tostring(errors)}
+redis.call('HSET', KEYS[1], host .. '|concurrency', result[1], host .. '|rate', result[2],
+           host .. '|latency', result[3], host .. '|error_rate', result[4], host .. '|last_decrease',
+           tostring(last_decrease), host .. '|blocked_until', result[5], host .. '|requests', result[6],
+           host .. '|errors', result[7])
+return result
+"""
+
+
+def parse_retry_after(value, now=None):
+    """
+    解析 Retry-After 头（秒数或 HTTP 日期）
+    :return: 需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (now or time.time()))
+
+
+def prune_host_limits(redis_client, max_age=HOST_LIMITS_MAX_AGE, now=None):
+    """
+    清理监控哈希中长时间未更新的字段（崩溃或被杀死、来不及自行清理的工作进程）
+    :return: 清理的字段数量
+    """
+    deadline = (now or time.time()) - max_age
+    stale = []
+    for field, value in redis_client.hgetall(HOST_LIMITS_KEY).items():
+        try:
+            updated = json.loads(value).get('updated', 0)
+        except ValueError:
+            updated = 0
+        if updated < deadline:
+            stale.append(field)
+    if stale:
+        redis_client.hdel(HOST_LIMITS_KEY, *stale)
+    return len(stale)
+
+
+class HostState:
+    def __init__(self, concurrency, rate):
+        self.concurrency = concurrency  # 允许的并发数（浮点，取整后生效）
+        self.rate = rate  # 允许的请求速率（次/秒）
+        self.in_flight = 0  # 本进程的在途请求数
+        self.next_send = 0.0  # 下一次允许发送的时间
+        self.blocked_until = 0.0  # Retry-After 要求的等待截止时间
+        self.wait_until = 0.0  # 共享模式下最近一次未获得许可时，预计可以发送的时间
+        self.latency = None  # 延迟的指数移动平均（秒）
+        self.error_rate = 0.0  # 错误率的指数移动平均
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def to_dict(self):
+        return {
+            'concurrency': int(self.concurrency),
+            'rate': round(self.rate, 3),
+            'in_flight': self.in_flight,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'blocked_until': self.blocked_until,
+            'requests': self.requests,
+            'errors': self.errors,
+        }
+
+
+class AdaptiveRateController:
+    def __init__(self, initial_concurrency=2, max_concurrency=32, min_rate=0.2, initial_rate=2.0, max_rate=50.0,
+                 additive_increase=0.5, decrease_factor=0.5, target_latency=2.0, ewma_alpha=0.2,
+                 decrease_cooldown=None, redis_client=None, publish_interval=5, permit_lease=PERMIT_LEASE):
+        """
+        按主机的 AIMD 并发与速率控制器，线程安全
+        :param initial_concurrency: 新主机的初始并发数
+        :param max_concurrency: 单个主机的最大并发数
+        :param min_rate: 最小请求速率（次/秒）
+        :param initial_rate: 新主机的初始请求速率（次/秒）
+        :param max_rate: 最大请求速率（次/秒）
+        :param additive_increase: 每个往返周期并发数和速率的加性增量
+        :param decrease_factor: 出错或超过目标延迟时的乘性减小系数
+        :param target_latency: 目标延迟（秒），延迟的移动平均超过它视为拥塞
+        :param ewma_alpha: 延迟和错误率移动平均的平滑系数
+        :param decrease_cooldown: 两次乘性减小之间的最短间隔（秒），默认取当前延迟，避免一批错误连续减半
+        :param redis_client: 可选的 Redis 客户端；提供时限制和许可在所有工作进程间共享（HOST_STATE_KEY），
+                             并向监控 API 发布各主机的当前限制；为 None 时只在本进程内限速
+        :param publish_interval: 发布间隔（秒）
+        :param permit_lease: 共享许可的租期（秒）
+        """
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_rate = min_rate
+        self.initial_rate = initial_rate
+        self.max_rate = max_rate
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.target_latency = target_latency
+        self.ewma_alpha = ewma_alpha
+        self.decrease_cooldown = decrease_cooldown
+        self.redis_client = redis_client
+        self.publish_interval = publish_interval
+        self.permit_lease = permit_lease
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self.hosts = {}
+        self._leases = {}  # 主机 -> 本进程持有的共享许可标识
+        self._lease_ids = itertools.count()
+        self._last_publish = 0.0
+        self._last_prune = 0.0
+        self._cond = threading.Condition()
+        if redis_client is not None:
+            self._acquire_script = redis_client.register_script(_ACQUIRE_SCRIPT)
+            self._release_script = redis_client.register_script(_RELEASE_SCRIPT)
+
+    def _state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.initial_concurrency, self.initial_rate)
+        return state
+
+    def _lease_key(self, host):
+        return f"{HOST_LEASES_KEY}:{host}"
+
+    def acquire(self, host, timeout=None):
+        """
+        等待直到该主机的并发数、速率和 Retry-After 都允许发送请求
+        :param host: 主机名
+        :param timeout: 最长等待时间（秒），None 表示一直等待
+        :return: 是否获得发送许可
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if self.redis_client is not None:
+            return self._acquire_shared(host, deadline)
+        with self._cond:
+            state = self._state(host)
+            while True:
+                now = time.time()
+                wait = max(state.blocked_until, state.next_send) - now
+                if state.in_flight >= max(1, int(state.concurrency)):
+                    wait = max(wait, 0.05)  # 等待其他请求释放
+                if wait <= 0:
+                    state.in_flight += 1
+                    state.next_send = max(now, state.next_send) + 1.0 / state.rate
+                    return True
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = min(wait, deadline - now)
+                self._cond.wait(wait)
+
+    def _acquire_shared(self, host, deadline):
+        lease_id = f"{self.worker_name}:{next(self._lease_ids)}"
+        while True:
+            now = time.time()
+            wait = float(self._acquire_script(keys=[HOST_STATE_KEY, self._lease_key(host)],
+                                              args=[host, lease_id, now, self.permit_lease,
+                                                    self.initial_concurrency, self.initial_rate]))
+            with self._cond:
+                state = self._state(host)
+                if wait <= 0:
+                    state.in_flight += 1
+                    self._leases.setdefault(host, []).append(lease_id)
+                    return True
+                state.wait_until = now + wait
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            time.sleep(wait)  # 其他进程释放许可时无法通知，按脚本给出的等待时间重试
+
+    def _pop_lease(self, state, host):
+        with self._cond:
+            state.in_flight = max(0, state.in_flight - 1)
+            leases = self._leases.get(host)
+            return leases.pop() if leases else ''
+
+    def wait_time(self, host):
+        """
+        距离该主机允许发送下一个请求的秒数，用于 acquire 未获得许可时安排延迟重新入队
+        """
+        with self._cond:
+            state = self._state(host)
+            if self.redis_client is not None:
+                return max(0.0, state.wait_until - time.time())
+            wait = max(state.blocked_until, state.next_send) - time.time()
+            if state.in_flight >= max(1, int(state.concurrency)):
+                wait = max(wait, 0.05)
+            return max(0.0, wait)
+
+    def cancel(self, host):
+        """
+        归还未使用的许可（请求没有发出），不影响该主机的限制
+        """
+        state = self._state(host)
+        if self.redis_client is not None:
+            lease_id = self._pop_lease(state, host)
+            if lease_id:
+                self.redis_client.zrem(self._lease_key(host), lease_id)
+            return
+        with self._cond:
+            state.in_flight = max(0, state.in_flight - 1)
+            self._cond.notify_all()
+
+    def release(self, host, status=None, latency=None, retry_after=None, error=False):
+        """
+        报告请求结果并调整该主机的限制
+        :param host: 主机名
+        :param status: HTTP 状态码，网络错误时为 None
+        :param latency: 请求耗时（秒）
+        :param retry_after: 响应的 Retry-After 头
+        :param error: 是否为网络错误（超时、连接失败等）
+        """
+        now = time.time()
+        throttled = status in THROTTLE_STATUS
+        failed = error or throttled or (status is not None and status >= 500)
+        delay = parse_retry_after(retry_after, now) if throttled else None
+        if self.redis_client is not None:
+            self._release_shared(host, now, latency, failed, delay)
+        else:
+            with self._cond:
+                state = self._state(host)
+                state.in_flight = max(0, state.in_flight - 1)
+                self._adjust(state, now, latency, failed, delay)
+                self._cond.notify_all()
+        self.maybe_publish()
+
+    def _adjust(self, state, now, latency, failed, delay):
+        state.requests += 1
+        if latency is not None:
+            state.latency = latency if state.latency is None else (
+                self.ewma_alpha * latency + (1 - self.ewma_alpha) * state.latency)
+
+        state.error_rate = self.ewma_alpha * failed + (1 - self.ewma_alpha) * state.error_rate
+        if failed:
+            state.errors += 1
+
+        if delay:
+            state.blocked_until = max(state.blocked_until, now + delay)
+
+        congested = state.latency is not None and state.latency > self.target_latency
+        if failed or congested:
+            cooldown = self.decrease_cooldown
+            if cooldown is None:
+                cooldown = state.latency or 1.0
+            if now - state.last_decrease >= cooldown:
+                state.concurrency = max(1.0, state.concurrency * self.decrease_factor)
+                state.rate = max(self.min_rate, state.rate * self.decrease_factor)
+                state.last_decrease = now
+        else:
+            # 每个成功的请求增加 additive_increase / 并发数，相当于每个往返周期加 additive_increase
+            state.concurrency = min(self.max_concurrency,
+                                    state.concurrency + self.additive_increase / state.concurrency)
+            state.rate = min(self.max_rate, state.rate + self.additive_increase / max(1.0, state.concurrency))
+
+    def _release_shared(self, host, now, latency, failed, delay):
+        state = self._state(host)
+        lease_id = self._pop_lease(state, host)
+        result = self._release_script(
+            keys=[HOST_STATE_KEY, self._lease_key(host)],
+            args=[host, lease_id, now, '' if latency is None else latency, int(failed), delay or '',
+                  self.initial_concurrency, self.initial_rate, self.max_concurrency, self.min_rate, self.max_rate,
+                  self.additive_increase, self.decrease_factor, self.target_latency, self.ewma_alpha,
+                  '' if self.decrease_cooldown is None else self.decrease_cooldown])
+        concurrency, rate, latency, error_rate, blocked_until, requests, errors = [
+            value.decode('utf-8') if isinstance(value, bytes) else value for value in result]
+        # 本地只保留共享状态的副本，供监控发布
+        with self._cond:
+            state.concurrency = float(concurrency)
+            state.rate = float(rate)
+            state.latency = float(latency) if latency else None
+            state.error_rate = float(error_rate)
+            state.blocked_until = float(blocked_until)
+            state.requests = int(float(requests))
+            state.errors = int(float(errors))
+
+    def snapshot(self):
+        """
+        获取所有主机的当前限制
+        """
+        with self._cond:
+            return {host: state.to_dict() for host, state in self.hosts.items()}
+
+    def maybe_publish(self, force=False):
+        """
+        按发布间隔将本进程看到的各主机限制写入 HOST_LIMITS_KEY，供监控 API 读取
+        """
+        if self.redis_client is None:
+            return
+        now = time.time()
+        if not force and now - self._last_publish < self.publish_interval:
+            return
+        self._last_publish = now
+        snapshot = self.snapshot()
+        if not snapshot:
+            return
+        mapping = {}
+        for host, limits in snapshot.items():
+            limits['updated'] = now
+            mapping[f"{self.worker_name}|{host}"] = json.dumps(limits)
+        try:
+            self.redis_client.hset(HOST_LIMITS_KEY, mapping=mapping)
+            if now - self._last_prune >= HOST_LIMITS_MAX_AGE:
+                self._last_prune = now
+                prune_host_limits(self.redis_client, now=now)
+        except Exception:
+            pass  # 监控数据发布失败不影响抓取
+
+    def unpublish(self):
+        """
+        工作进程退出时删除本进程发布的字段
+        """
+        if self.redis_client is None:
+            return
+        fields = [f"{self.worker_name}|{host}" for host in self.snapshot()]
+        if fields:
+            try:
+                self.redis_client.hdel(HOST_LIMITS_KEY, *fields)
+            except Exception:
+                pass
@@ -0,0 +1,204 @@
+import redis
+from serialization import get_codec, decode_or_quarantine, QUARANTINE_QUEUE, QUEUE_CODEC
+from link_discovery import canonicalize_seed
+
+class RedisURLQueue:
+    def __init__(self, host='localhost', port=6379, db=0, queue_name='url_queue', processed_set='processed_urls',
+                 codec=QUEUE_CODEC, discovered_set='discovered_urls', quarantine_queue=QUARANTINE_QUEUE):
+        try:
+            self.redis_client = redis.Redis(host=host, port=port, db=db)
+            self.queue_name = queue_name
+            self.processed_set = processed_set
+            # 发现过的链接，永久保存，确认完成时不会移除，避免已抓取的页面被其他页面再次链接时重复入队
+            self.discovered_set = discovered_set
+            # 无法解码的载荷移入该列表，不会在出队时丢失
+            self.quarantine_queue = quarantine_queue
+            # 队列载荷编解码（json、orjson、msgpack），载荷带格式字节，不同编解码的生产者和消费者可以混用
+            self.codec = get_codec(codec)
+            self.redis_client.ping()
+            print("Connected to Redis successfully!")
+        except Exception as e:
+            print(f"Failed to connect to Redis: {e}")
+            raise
+
+    def enqueue_with_dedup(self, url, metadata=None):
+        """
+        同时去重和加入队列，URL 先规范化并记入 discovered_set，之后从页面中发现同一链接时不会重复入队
+        :param url: 要加入队列的URL
+        :param metadata: 可选的元数据
+        """
+        url = canonicalize_seed(url)
+        self.redis_client.sadd(self.discovered_set, url)
+        # 检查URL是否已经被处理过
+        if self.redis_client.sismember(self.processed_set, url):
+            print(f"URL {url} already processed, skipping...")
+            return
+        
+        item = {'url': url}
+        if metadata:
+            item['metadata'] = metadata
+        
+        # 将URL和元数据加入队列
+        self.redis_client.rpush(self.queue_name, self.codec.encode(item))
+        # 将URL标记为已处理
+        self.redis_client.sadd(self.processed_set, url)
+
+    def enqueue_batch_with_dedup(self, items):
+        """
+        批量去重并加入队列，使用 pipeline 将网络往返减少到两次
+        按永久的 discovered_set 去重，已抓取并确认完成的 URL 不会再次入队
+        :param items: (url, metadata) 元组列表
+        :return: 实际加入队列的URL数量
+        """
+        if not items:
+            return 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        for url, _ in items:
+            pipe.sadd(self.discovered_set, url)
+        added = pipe.execute()
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        count = 0
+        for (url, metadata), is_new in zip(items, added):
+            if not is_new:
+                continue
+            item = {'url': url}
+            if metadata:
+                item['metadata'] = metadata
+            pipe.rpush(self.queue_name, self.codec.encode(item))
+            pipe.sadd(self.processed_set, url)
+            count += 1
+        if count:
+            pipe.execute()
+        return count
+
+    def mark_discovered(self, urls):
+        """
+        将 URL 记入 discovered_set（如正在抓取的页面），之后发现这些链接时不再入队
+        :param urls: 规范化后的 URL 列表
+        """
+        if urls:
+            self.redis_client.sadd(self.discovered_set, *urls)
+
+    def enqueue_batch(self, items):
+        """
+        批量加入队列（不去重），使用 pipeline 一次往返完成
+        :param items: (url, metadata) 元组列表
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        for url, metadata in items:
+            item = {'url': url}
+            if metadata:
+                item['metadata'] = metadata
+            pipe.rpush(self.queue_name, self.codec.encode(item))
+        pipe.execute()
+
+    def enqueue(self, url, metadata=None):
+        """
+        将URL和可选的元数据加入队列
+        :param url: 要加入队列的URL
+        :param metadata: 可选的元数据
+        """
+        item = {'url': url}
+        if metadata:
+            item['metadata'] = metadata
+        self.redis_client.rpush(self.queue_name, self.codec.encode(item))
+
+    def dequeue(self):
+        """
+        从队列中取出一个URL及其元数据
+        :return: URL及其元数据的字典，如果没有数据则返回None
+        """
+        while True:
+            item = self.redis_client.lpop(self.queue_name)
+            if not item:
+                return None
+            task = decode_or_quarantine(self.codec, self.redis_client, item, self.quarantine_queue)
+            if task is not None:
+                return task
+
+    def size(self):
+        """
+        获取队列中元素的数量
+        :return: 队列的长度
+        """
+        return self.redis_client.llen(self.queue_name)
+
+    def clear(self):
+        """
+        清空队列
+        """
+        self.redis_client.delete(self.queue_name)
+        self.redis_client.delete(self.processed_set)
+        self.redis_client.delete(self.discovered_set)
+
+    def peek(self):
+        """
+        查看队列头部的元素，但不移除它
+        :return: 队列头部的URL及其元数据，如果没有数据则返回None
+        """
+        item = self.redis_client.lindex(self.queue_name, 0)
+        if item:
+            return self.codec.decode(item)
+        return None
+
+    def distribute_tasks(self, num_tasks=10):
+        """
+        分发指定数量的任务到多个消费者
+        :param num_tasks: 要分发的任务数量
+        :return: 分发的任务列表
+        """
+        tasks = []
+        for _ in range(num_tasks):
+            task = self.redis_client.rpoplpush(self.queue_name, 'processing_queue')
+            if task:
+                decoded = decode_or_quarantine(self.codec, self.redis_client, task, self.quarantine_queue)
+                if decoded is None:
+                    self.redis_client.lrem('processing_queue', 1, task)
+                else:
+                    tasks.append(decoded)
+        return tasks
+
+    def acknowledge_completion(self, task):
+        """
+        确认任务完成，并从处理队列中移除
+        :param task: 完成的任务
+        """
+        url = task['url']
+        self.redis_client.srem(self.processed_set, url)
+        for payload in self.codec.encodings(task):
+            if self.redis_client.lrem('processing_queue', 0, payload):
+                break
+
+
+# 示例用法
+if __name__ == "__main__":
+    try:
+        queue = RedisURLQueue()
+
+        # 添加URL到队列（支持去重）
+        queue.enqueue_with_dedup("http://example.com", metadata={"priority": 1})
+        queue.enqueue_with_dedup("http://example.org", metadata={"priority": 2})
+        queue.enqueue_with_dedup("http://example.net", metadata={"priority": 3})
+        queue.enqueue_with_dedup("http://example.com", metadata={"priority": 1})  # 重复URL，会被去重
+
+        print("Queue size:", queue.size())  # 队列大小为3
+
+        # 分发任务
+        distributed_tasks = queue.distribute_tasks(num_tasks=2)
+        print("Distributed tasks:", distributed_tasks)
+
+        # 模拟任务完成
+        if distributed_tasks:
+            completed_task = distributed_tasks[0]
+            queue.acknowledge_completion(completed_task)
+            print("Task completed:", completed_task)
+
+        print("Queue size after completion:", queue.size())  # 队列大小减少
+
+        # 清空队列
+        queue.clear()
+        print("Queue size after clear:", queue.size())  # 队列大小为0
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
\ No newline at end of file
@@ -0,0 +1,176 @@
+# 查询结果缓存
+## 进程内 LRU + 可选的 Redis 共享缓存，按规范化后的查询参数作为键；
+## 存储端每次写入都会递增集合版本号，版本号是缓存键的一部分，旧结果随之失效。
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from serialization import dumps_json, loads_json
+
+VERSION_KEY = 'collection_version:{}'  # 集合版本号，存储端写入后 INCR
+CACHE_KEY = 'query_cache:{}:{}:{}'  # 集合名、版本号、规范化后的查询
+
+
+def bump_collection_version(redis_client, collection):
+    """
+    存储端写入后调用，递增集合版本号，使该集合的所有缓存结果失效
+    :param redis_client: Redis 客户端
+    :param collection: 集合名称
+    """
+    try:
+        redis_client.incr(VERSION_KEY.format(collection))
+    except Exception as e:
+        logging.error(f"递增集合 {collection} 的版本号失败: {e}")
+
+
+class LRUCache:
+    def __init__(self, max_entries=10000, ttl=60):
+        """
+        线程安全的进程内 LRU 缓存，条目带过期时间
+        :param max_entries: 最大条目数
+        :param ttl: 条目存活时间（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    def __init__(self, collection, redis_client=None, max_entries=10000, ttl=60, version_check_interval=1.0):
+        """
+        读穿透查询缓存
+        :param collection: 被缓存的集合名称，用于版本号和缓存键
+        :param redis_client: 可选的 Redis 客户端，提供时启用共享缓存并从 Redis 读取集合版本号
+        :param max_entries: 进程内缓存的最大条目数
+        :param ttl: 缓存条目存活时间（秒）
+        :param version_check_interval: 重新读取集合版本号的间隔（秒），决定写入后旧结果最多存活多久
+        """
+        self.collection = collection
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self.local = LRUCache(max_entries, ttl)
+        self._version = 0
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def version(self):
+        """
+        获取集合当前版本号，按 version_check_interval 缓存
+        """
+        if self.redis_client is None:
+            return self._version
+        now = time.time()
+        if now - self._version_checked >= self.version_check_interval:
+            try:
+                self._version = int(self.redis_client.get(VERSION_KEY.format(self.collection)) or 0)
+            except Exception as e:
+                self._count('errors')
+                logging.error(f"读取集合版本号失败: {e}")
+            self._version_checked = now
+        return self._version
+
+    def invalidate(self):
+        """
+        使当前集合的所有缓存结果失效
+        """
+        if self.redis_client is not None:
+            bump_collection_version(self.redis_client, self.collection)
+            self._version_checked = 0.0
+        else:
+            self._version += 1
+
+    @staticmethod
+    def normalize(endpoint, params, verbatim=()):
+        """
+        规范化缓存键：去除参数值首尾空格、按参数名排序；只影响缓存键，不改变传给查询的参数
+        :param verbatim: 首尾空格有意义的参数名（如正则表达式），这些参数原样计入缓存键
+        """
+        items = []
+        for name in sorted(params):
+            value = params[name]
+            if isinstance(value, str) and name not in verbatim:
+                value = value.strip()
+            items.append(f"{name}={value}")
+        return f"{endpoint}?{'&'.join(items)}"
+
+    def get_or_compute(self, endpoint, params, compute, verbatim=()):
+        """
+        读取缓存结果，未命中时调用 compute 计算并写入两级缓存
+        :param endpoint: 接口名称
+        :param params: 已规范化类型的查询参数字典
+        :param compute: 无参函数，返回可 JSON 序列化的结果
+        :param verbatim: 原样计入缓存键的参数名，见 normalize
+        :return: 查询结果
+        """
+        key = CACHE_KEY.format(self.collection, self.version(), self.normalize(endpoint, params, verbatim))
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+
+        if self.redis_client is not None:
+            try:
+                payload = self.redis_client.get(key)
+            except Exception as e:
+                payload = None
+                self._count('errors')
+                logging.error(f"读取共享缓存失败: {e}")
+            if payload is not None:
+                value = loads_json(payload)
+                self.local.set(key, value)
+                self._count('shared_hits')
+                return value
+
+        self._count('misses')
+        value = compute()
+        self.local.set(key, value)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(key, dumps_json(value), ex=self.ttl)
+            except Exception as e:
+                self._count('errors')
+                logging.error(f"写入共享缓存失败: {e}")
+        return value
+
+    def get_stats(self):
+        """
+        获取命中率统计
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        stats['local_entries'] = len(self.local)
+        stats['version'] = self._version
+        return stats
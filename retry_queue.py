@@ -0,0 +1,207 @@
+# 延迟重试队列
+## 失败的任务按下次尝试时间写入 Redis 有序集合，由 mover 批量移回工作队列，工作进程不再阻塞等待；
+## 退避时间按错误类别指数增长并加入随机抖动，超过最大次数的任务进入死信队列。
+
+import json
+import time
+import random
+import logging
+import argparse
+from collections import namedtuple
+
+from serialization import get_codec, decode_or_quarantine, QUEUE_CODEC, CODECS
+
+# 每类错误的重试策略：最大尝试次数、初始退避时间（秒）、最大退避时间（秒）
+RetryPolicy = namedtuple('RetryPolicy', ['max_attempts', 'base_delay', 'max_delay'])
+
+RETRY_POLICIES = {
+    'throttled': RetryPolicy(6, 30, 1800),  # 429/503，被限流
+    'server': RetryPolicy(4, 10, 600),  # 其他 5xx
+    'network': RetryPolicy(5, 5, 300),  # 超时、连接失败、代理错误
+    'client': RetryPolicy(0, 0, 0),  # 其他 4xx，重试无意义，直接进入死信队列
+    'default': RetryPolicy(3, 5, 300),
+}
+
+# 原子地取出到期的重试任务并从有序集合中删除
+_POP_DUE_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #items > 0 then
+    redis.call('ZREM', KEYS[1], unpack(items))
+end
+return items
+"""
+
+
+def classify_status(status):
+    """
+    按 HTTP 状态码划分错误类别
+    """
+    if status in (429, 503):
+        return 'throttled'
+    if status is not None and status >= 500:
+        return 'server'
+    if status is not None and status >= 400:
+        return 'client'
+    return 'default'
+
+
+def backoff_delay(policy, attempts, retry_after=None):
+    """
+    计算带抖动的指数退避时间（equal jitter：一半固定、一半随机）
+    :param policy: RetryPolicy
+    :param attempts: 已失败的次数（从 1 开始）
+    :param retry_after: 服务端要求的最短等待时间（秒）
+    :return: 等待时间（秒）
+    """
+    backoff = min(policy.max_delay, policy.base_delay * 2 ** (attempts - 1))
+    delay = backoff / 2 + random.uniform(0, backoff / 2)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class RetryQueue:
+    def __init__(self, queue, redis_client, retry_set='url_retry', dead_letter_queue='url_dead_letter',
+                 policies=None, codec=None):
+        """
+        延迟重试队列
+        :param queue: 工作队列（RedisURLQueue 或 ShardedURLQueue），到期的任务移回这里
+        :param redis_client: 保存重试有序集合和死信队列的 Redis 客户端
+        :param retry_set: 重试有序集合名称，score 为下次尝试时间
+        :param dead_letter_queue: 死信队列名称
+        :param policies: 按错误类别的 RetryPolicy 字典，缺省使用 RETRY_POLICIES
+        :param codec: 有序集合成员的编解码，缺省与工作队列相同；死信队列始终使用 JSON 便于查看
+        """
+        self.queue = queue
+        self.redis_client = redis_client
+        self.retry_set = retry_set
+        self.dead_letter_queue = dead_letter_queue
+        self.policies = dict(RETRY_POLICIES, **(policies or {}))
+        self.codec = get_codec(codec or getattr(queue, 'codec', QUEUE_CODEC))
+        self._pop_due = redis_client.register_script(_POP_DUE_SCRIPT)
+
+    def schedule_retry(self, task, error_class='default', error=None, retry_after=None):
+        """
+        记录一次失败，安排延迟重试或移入死信队列
+        :param task: 失败的任务（包含 url 和可选 metadata）
+        :param error_class: 错误类别，决定重试策略
+        :param error: 错误描述
+        :param retry_after: 服务端要求的最短等待时间（秒）
+        :return: 下次尝试的时间戳，进入死信队列时返回 None
+        """
+        policy = self.policies.get(error_class, self.policies['default'])
+        metadata = dict(task.get('metadata') or {})
+        attempts = metadata.get('retry', {}).get('attempts', 0) + 1
+        metadata['retry'] = {'attempts': attempts, 'error_class': error_class, 'last_error': str(error)[:500]}
+        retry_task = {'url': task['url'], 'metadata': metadata}
+
+        if attempts > policy.max_attempts:
+            self.redis_client.rpush(self.dead_letter_queue, json.dumps(
+                dict(retry_task, failed_at=time.time()), ensure_ascii=False))
+            logging.warning(f"{task['url']} 失败 {attempts} 次（{error_class}），已移入死信队列")
+            return None
+
+        due = time.time() + backoff_delay(policy, attempts, retry_after)
+        self.redis_client.zadd(self.retry_set, {self.codec.encode(retry_task): due})
+        logging.info(f"{task['url']} 第 {attempts} 次失败（{error_class}），将在 {due - time.time():.1f} 秒后重试")
+        return due
+
+    def defer(self, task, delay):
+        """
+        暂缓一个未发送的任务（例如主机限速未给出许可），到期后回到工作队列，不计入重试次数
+        :param task: 任务（包含 url 和可选 metadata）
+        :param delay: 延迟秒数
+        :return: 到期时间戳
+        """
+        item = {'url': task['url']}
+        if task.get('metadata'):
+            item['metadata'] = task['metadata']
+        due = time.time() + delay
+        self.redis_client.zadd(self.retry_set, {self.codec.encode(item): due})
+        return due
+
+    def promote_due(self, batch_size=500):
+        """
+        将到期的重试任务批量移回工作队列
+        :param batch_size: 每批移动的最大任务数
+        :return: 移动的任务数量
+        """
+        moved = 0
+        while True:
+            items = self._pop_due(keys=[self.retry_set], args=[time.time(), batch_size])
+            if not items:
+                return moved
+            tasks = [decode_or_quarantine(self.codec, self.redis_client, item) for item in items]
+            tasks = [task for task in tasks if task is not None]
+            try:
+                self.queue.enqueue_batch([(task['url'], task.get('metadata')) for task in tasks])
+            except Exception:
+                # 写回工作队列失败时放回有序集合，稍后再试
+                self.redis_client.zadd(self.retry_set, {item: time.time() for item in items})
+                raise
+            moved += len(tasks)
+            if len(items) < batch_size:
+                return moved
+
+    def pending(self):
+        """
+        获取等待重试的任务数量
+        """
+        return self.redis_client.zcard(self.retry_set)
+
+    def next_due_in(self):
+        """
+        距离最早一个重试任务到期的秒数，没有等待的任务时返回 None
+        """
+        first = self.redis_client.zrange(self.retry_set, 0, 0, withscores=True)
+        if not first:
+            return None
+        return max(0.0, first[0][1] - time.time())
+
+    def dead_letters(self, count=100):
+        """
+        查看死信队列中的任务
+        """
+        return [json.loads(item) for item in self.redis_client.lrange(self.dead_letter_queue, 0, count - 1)]
+
+    def run_mover(self, interval=1.0, batch_size=500):
+        """
+        持续将到期的重试任务移回工作队列
+        :param interval: 轮询间隔（秒）
+        :param batch_size: 每批移动的最大任务数
+        """
+        while True:
+            moved = self.promote_due(batch_size)
+            if moved:
+                logging.info(f"已将 {moved} 个到期的重试任务移回工作队列")
+            time.sleep(interval)
+
+
+if __name__ == '__main__':
+    import redis
+    from redis_url_queue import RedisURLQueue
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Delayed retry queue")
+    parser.add_argument('command', choices=['mover', 'stats', 'dead_letters'], help='Run the mover or inspect the retry queue')
+    parser.add_argument('--redis_host', type=str, default='localhost', help='Redis server address')
+    parser.add_argument('--redis_port', type=int, default=6379, help='Redis server port')
+    parser.add_argument('--redis_db', type=int, default=0, help='Redis database number')
+    parser.add_argument('--interval', type=float, default=1.0, help='Mover polling interval (seconds)')
+    parser.add_argument('--codec', type=str, default=QUEUE_CODEC, choices=list(CODECS), help='Queue payload codec')
+    args = parser.parse_args()
+
+    retry_queue = RetryQueue(
+        RedisURLQueue(host=args.redis_host, port=args.redis_port, db=args.redis_db, codec=args.codec),
+        redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    )
+    if args.command == 'mover':
+        retry_queue.run_mover(interval=args.interval)
+    elif args.command == 'stats':
+        print("Pending retries:", retry_queue.pending())
+        print("Next due in:", retry_queue.next_due_in())
+        print("Dead letters:", retry_queue.redis_client.llen(retry_queue.dead_letter_queue))
+    else:
+        for item in retry_queue.dead_letters():
+            print(item)
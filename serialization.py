@@ -0,0 +1,229 @@
+# 序列化编解码
+## 队列载荷和存储的可插拔编解码层，支持标准库 json、orjson 和 msgpack。
+## 每个载荷以一个格式字节开头，消费者据此选择解码方式，不同编解码的生产者和消费者可以混用；
+## 不带格式字节的旧 JSON 载荷（以 "{" 开头）仍然可以解码。
+## 队列载荷默认使用紧凑的 msgpack（QUEUE_CODEC），所有生产者和消费者都必须安装 msgpack；orjson 为可选加速。
+
+import json
+import time
+import logging
+import argparse
+
+FORMAT_JSON = b'\x01'  # JSON 文本（json 和 orjson 写出的格式相同）
+FORMAT_MSGPACK = b'\x02'  # msgpack 二进制
+QUARANTINE_QUEUE = 'payload_quarantine'  # 无法解码的载荷原样移入此列表，不会丢失
+QUEUE_CODEC = 'msgpack'  # 队列、重试集合等所有队列载荷使用的编解码，生产者和消费者共用
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import msgpack
+
+
+def loads_json(data):
+    """
+    解析 JSON（bytes 或 str），有 orjson 时使用 orjson
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_json(obj, indent=False):
+    """
+    序列化为 UTF-8 编码的 JSON 字节，有 orjson 时使用 orjson
+    :param obj: 要序列化的对象
+    :param indent: 是否缩进输出（便于人工查看）
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None,
+                      separators=None if indent else (',', ':')).encode('utf-8')
+
+
+class JsonCodec:
+    name = 'json'
+    format_byte = FORMAT_JSON
+
+    def encode(self, obj):
+        return self.format_byte + json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def decode_body(self, body):
+        return json.loads(body)
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+
+    def encode(self, obj):
+        return self.format_byte + orjson.dumps(obj)
+
+    def decode_body(self, body):
+        return orjson.loads(body)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+    format_byte = FORMAT_MSGPACK
+
+    def encode(self, obj):
+        return self.format_byte + msgpack.packb(obj, use_bin_type=True)
+
+    def decode_body(self, body):
+        return msgpack.unpackb(body, raw=False)
+
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+class Codec:
+    def __init__(self, name=QUEUE_CODEC):
+        """
+        带格式字节的编解码器：用指定的实现编码，解码时按格式字节自动选择实现
+        :param name: 编码使用的实现（json、orjson、msgpack），'auto' 表示有 orjson 时用 orjson，否则用 json
+        """
+        if name == 'auto':
+            name = 'orjson' if orjson is not None else 'json'
+        if name not in CODECS:
+            raise ValueError(f"Unknown codec: {name}")
+        self.encoder = CODECS[name]()
+        self.name = name
+        self._json = OrjsonCodec() if orjson is not None else JsonCodec()
+        self._msgpack = MsgpackCodec()
+
+    def encode(self, obj):
+        """
+        编码为带格式字节的载荷
+        """
+        return self.encoder.encode(obj)
+
+    def decode(self, payload):
+        """
+        解码载荷，支持任意已知格式以及不带格式字节的旧 JSON 载荷
+        """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        head = payload[:1]
+        if head == FORMAT_JSON:
+            return self._json.decode_body(payload[1:])
+        if head == FORMAT_MSGPACK:
+            return self._msgpack.decode_body(payload[1:])
+        if head in (b'{', b'['):
+            return self._json.decode_body(payload)  # 旧的纯 JSON 载荷
+        raise ValueError(f"Unknown payload format byte: {head!r}")
+
+    def encodings(self, obj):
+        """
+        对象在所有可用格式下的载荷，用于按值删除（LREM）由其他编解码写入的元素
+        """
+        payloads = [self.encode(obj)]
+        for codec in (self._json, self._msgpack):
+            payload = codec.encode(obj)
+            if payload not in payloads:
+                payloads.append(payload)
+        legacy = json.dumps(obj).encode('utf-8')
+        if legacy not in payloads:
+            payloads.append(legacy)
+        return payloads
+
+
+def get_codec(name=QUEUE_CODEC):
+    """
+    获取编解码器，name 可以是实现名称或已有的 Codec 实例
+    """
+    if isinstance(name, Codec):
+        return name
+    return Codec(name)
+
+
+def decode_or_quarantine(codec, redis_client, payload, quarantine_key=QUARANTINE_QUEUE):
+    """
+    解码已从队列中取出的载荷，无法解码（格式未知、内容损坏等）时原样写入隔离列表而不是丢弃
+    :param codec: Codec 实例
+    :param redis_client: 隔离列表所在的 Redis 客户端
+    :param payload: 载荷
+    :param quarantine_key: 隔离列表名称
+    :return: 解码后的对象，已隔离时返回 None
+    """
+    try:
+        return codec.decode(payload)
+    except Exception as e:
+        logging.error(f"无法解码队列载荷，已移入 {quarantine_key}: {e}")
+        redis_client.rpush(quarantine_key, payload)
+        return None
+
+
+def _sample_tasks(n):
+    return [{'url': f"https://p4psearch.1688.com/p4p114/p4psearch/offer.htm?keywords=item{i}&beginPage={i % 50}",
+             'metadata': {'depth': i % 3, 'parent': 'https://p4psearch.1688.com/', 'priority': i % 5}}
+            for i in range(n)]
+
+
+def benchmark(n=100000, redis_client=None):
+    """
+    测量各编解码实现的编解码吞吐和载荷大小
+    :param n: 任务数量
+    :param redis_client: 可选的 Redis 客户端，提供时实际写入列表测量 MEMORY USAGE
+    :return: 每个实现的结果字典列表
+    """
+    tasks = _sample_tasks(n)
+    legacy_bytes = sum(len(json.dumps(task)) for task in tasks)
+    results = []
+    for name in CODECS:
+        try:
+            codec = Codec(name)
+        except ImportError:
+            continue
+        start = time.perf_counter()
+        payloads = [codec.encode(task) for task in tasks]
+        encode_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for payload in payloads:
+            codec.encoder.decode_body(payload[1:])
+        decode_s = time.perf_counter() - start
+        payload_bytes = sum(len(p) for p in payloads)
+        result = {
+            'codec': name,
+            'encode_per_s': n / encode_s,
+            'decode_per_s': n / decode_s,
+            'avg_bytes': payload_bytes / n,
+            'saved_mb_per_million': (legacy_bytes - payload_bytes) / n * 1e6 / 1024 / 1024,
+        }
+        if redis_client is not None:
+            key = f"codec_benchmark:{name}"
+            redis_client.delete(key)
+            for i in range(0, n, 10000):
+                redis_client.rpush(key, *payloads[i:i + 10000])
+            result['redis_mb_per_million'] = redis_client.memory_usage(key, samples=0) / n * 1e6 / 1024 / 1024
+            redis_client.delete(key)
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Codec benchmark")
+    parser.add_argument('--tasks', type=int, default=100000, help='Number of sample queue tasks')
+    parser.add_argument('--redis_host', type=str, default=None, help='Measure actual Redis memory on this server')
+    parser.add_argument('--redis_port', type=int, default=6379, help='Redis server port')
+    args = parser.parse_args()
+
+    client = None
+    if args.redis_host:
+        import redis
+        client = redis.Redis(host=args.redis_host, port=args.redis_port)
+
+    print(f"{'codec':>8} {'encode/s':>12} {'decode/s':>12} {'avg bytes':>10} {'saved MB/1M':>12} {'redis MB/1M':>12}")
+    for r in benchmark(args.tasks, client):
+        redis_mb = f"{r['redis_mb_per_million']:.1f}" if 'redis_mb_per_million' in r else '-'
+        print(f"{r['codec']:>8} {r['encode_per_s']:>12,.0f} {r['decode_per_s']:>12,.0f} {r['avg_bytes']:>10.1f} "
+              f"{r['saved_mb_per_million']:>12.1f} {redis_mb:>12}")
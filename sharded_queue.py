@@ -0,0 +1,472 @@
+import bisect
+import hashlib
+import time
+from urllib.parse import urlsplit
+
+import redis
+
+from serialization import get_codec, dumps_json, loads_json, decode_or_quarantine, QUARANTINE_QUEUE, QUEUE_CODEC
+from link_discovery import canonicalize_seed
+
+DEFAULT_PARTITIONS = 64  # 逻辑分区数量，URL 按主机名哈希到固定分区，分区再通过一致性哈希分配到节点
+DEFAULT_VNODES = 160  # 每个节点在哈希环上的虚拟节点数量
+POLL_SLICE = 0.05  # 轮询每个节点时 BLPOP 的阻塞时间（秒）
+RING_CHECK_INTERVAL = 5.0  # 重新读取 Redis 中发布的节点列表的间隔（秒）
+
+
+def node_name(host='localhost', port=6379, db=0):
+    """
+    节点的规范名称 "host:port/db"，同一节点的各种写法得到相同的名称，所有进程的哈希环才能一致
+    """
+    return f"{host}:{int(port)}/{int(db)}"
+
+
+def parse_node(node):
+    """
+    解析 "host:port/db"、"host:port"、"host" 或 "redis://host:port/db" 形式的节点字符串
+    :return: (host, port, db)
+    """
+    if '://' in node:
+        node = node.split('://', 1)[1]
+    address, _, db = node.partition('/')
+    host, _, port = address.partition(':')
+    return host or 'localhost', int(port or 6379), int(db or 0)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes=(), vnodes=DEFAULT_VNODES):
+        """
+        一致性哈希环
+        :param nodes: 节点名称列表
+        :param vnodes: 每个节点的虚拟节点数量
+        """
+        self.vnodes = vnodes
+        self._ring = []  # (hash, node) 有序列表
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        for i in range(self.vnodes):
+            bisect.insort(self._ring, (_hash(f"{node}#{i}"), node))
+
+    def remove_node(self, node):
+        self._ring = [entry for entry in self._ring if entry[1] != node]
+
+    def get_node(self, key):
+        """
+        获取 key 所属的节点
+        """
+        if not self._ring:
+            raise RuntimeError("Hash ring is empty.")
+        index = bisect.bisect(self._ring, (_hash(key),)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class ShardedURLQueue:
+    def __init__(self, nodes, queue_name='url_queue', processed_set='processed_urls',
+                 processing_queue='processing_queue', num_partitions=DEFAULT_PARTITIONS,
+                 vnodes=DEFAULT_VNODES, poll_slice=POLL_SLICE, codec=QUEUE_CODEC, discovered_set='discovered_urls',
+                 ring_check_interval=RING_CHECK_INTERVAL, client_factory=None, quarantine_queue=QUARANTINE_QUEUE):
+        """
+        跨多个 Redis 节点水平分片的 URL 队列，接口与 RedisURLQueue 保持一致
+        URL 按主机名分区，同一主机的任务始终落在同一节点上，便于在节点内做礼貌性控制
+        :param nodes: 节点列表，元素可以是 "host:port/db" 字符串、redis.Redis 实例
+                      或 {'host': ..., 'port': ..., 'db': ...} 字典，各种写法都规范化为 "host:port/db"
+                      Redis 中已发布节点列表时以发布的列表为准，否则发布本列表
+        :param queue_name: 队列名前缀
+        :param processed_set: 去重集合名前缀
+        :param processing_queue: 处理中列表名前缀
+        :param num_partitions: 逻辑分区数量，所有生产者和消费者必须一致
+        :param vnodes: 每个节点的虚拟节点数量
+        :param poll_slice: 轮询每个节点时 BLPOP 的阻塞时间（秒）
+        :param codec: 队列载荷编解码（json、orjson、msgpack），默认 QUEUE_CODEC
+        :param discovered_set: 发现链接去重集合名前缀，永久保存，确认完成时不会移除
+        :param ring_check_interval: 重新读取已发布节点列表的间隔（秒），其他进程加入节点后据此切换
+        :param client_factory: 可选的函数，根据 (host, port, db) 创建 Redis 客户端，测试时可传入返回 fakeredis 的函数
+        :param quarantine_queue: 无法解码的载荷移入所在节点上的该列表
+        """
+        self.queue_name = queue_name
+        self.processed_set = processed_set
+        self.discovered_set = discovered_set
+        self.quarantine_queue = quarantine_queue
+        self.processing_queue = processing_queue
+        self.num_partitions = num_partitions
+        self.poll_slice = poll_slice
+        self.codec = get_codec(codec)
+        self.vnodes = vnodes
+        self.ring_key = f"{queue_name}:ring"  # 每个节点上都保存一份 {"version": n, "nodes": [...]}
+        self.ring_check_interval = ring_check_interval
+        self.client_factory = client_factory or (lambda host, port, db: redis.Redis(host=host, port=port, db=db))
+        self.clients = {}  # 节点名 -> redis 客户端
+        self.ring = HashRing(vnodes=vnodes)
+        self.ring_version = 0
+        self._ring_checked = time.time()
+        self._rotation = 0
+        for node in nodes:
+            self._connect(node)
+        published = self._read_ring()
+        if published and published['nodes'] != sorted(self.clients):
+            self._apply_ring(published)
+        else:
+            self.ring_version = published['version'] if published else 0
+            self._assign_partitions()
+            if not published:
+                self._publish_ring()
+
+    def _connect(self, node):
+        if isinstance(node, str):
+            host, port, db = parse_node(node)
+            name = node_name(host, port, db)
+            client = self.clients.get(name) or self.client_factory(host, port, db)
+        elif isinstance(node, dict):
+            name = node_name(node.get('host', 'localhost'), node.get('port', 6379), node.get('db', 0))
+            client = redis.Redis(**node)
+        else:
+            kwargs = node.connection_pool.connection_kwargs
+            name = node_name(kwargs.get('host', 'localhost'), kwargs.get('port', 6379), kwargs.get('db', 0))
+            client = node
+        if name in self.clients:
+            return name
+        client.ping()
+        self.clients[name] = client
+        self.ring.add_node(name)
+        return name
+
+    def _read_ring(self):
+        """
+        读取已发布的节点列表，取各节点中版本号最高的一份
+        """
+        best = None
+        for client in self.clients.values():
+            try:
+                payload = client.get(self.ring_key)
+            except redis.RedisError:
+                continue
+            if payload:
+                ring = loads_json(payload)
+                if best is None or ring['version'] > best['version']:
+                    best = ring
+        return best
+
+    def _publish_ring(self):
+        """
+        将当前节点列表写入每个节点，其他进程按 ring_check_interval 重新读取
+        """
+        payload = dumps_json({'version': self.ring_version, 'nodes': sorted(self.clients)})
+        for client in self.clients.values():
+            client.set(self.ring_key, payload)
+
+    def _apply_ring(self, ring):
+        for name in ring['nodes']:
+            self._connect(name)
+        for name in set(self.clients) - set(ring['nodes']):
+            self.ring.remove_node(name)
+            del self.clients[name]
+        self.ring_version = ring['version']
+        self._assign_partitions()
+
+    def reload_ring(self, force=False):
+        """
+        按 ring_check_interval 检查已发布的节点列表，版本变化时切换到新的哈希环
+        :param force: 立即检查
+        :return: 是否切换了哈希环
+        """
+        now = time.time()
+        if not force and now - self._ring_checked < self.ring_check_interval:
+            return False
+        self._ring_checked = now
+        ring = self._read_ring()
+        if ring is None or ring['version'] <= self.ring_version:
+            return False
+        self._apply_ring(ring)
+        print(f"Hash ring reloaded: version {self.ring_version}, {len(self.clients)} nodes.")
+        return True
+
+    def _assign_partitions(self):
+        self.owners = [self.ring.get_node(f"partition:{p}") for p in range(self.num_partitions)]
+        self.node_partitions = {name: [] for name in self.clients}
+        for partition, owner in enumerate(self.owners):
+            self.node_partitions[owner].append(partition)
+
+    def partition_for(self, url):
+        """
+        计算 URL 所属的分区（按主机名哈希）
+        """
+        host = (urlsplit(url).hostname or url).lower()
+        return _hash(host) % self.num_partitions
+
+    def _keys(self, partition):
+        return (f"{self.queue_name}:{partition}", f"{self.processed_set}:{partition}",
+                f"{self.processing_queue}:{partition}")
+
+    def _discovered_key(self, partition):
+        return f"{self.discovered_set}:{partition}"
+
+    def _route(self, url):
+        self.reload_ring()
+        partition = self.partition_for(url)
+        return self.clients[self.owners[partition]], self._keys(partition)
+
+    def client_for(self, url):
+        """
+        获取 URL 所属节点的 Redis 客户端
+        """
+        return self._route(url)[0]
+
+    def _encode(self, url, metadata):
+        item = {'url': url}
+        if metadata:
+            item['metadata'] = metadata
+        return self.codec.encode(item)
+
+    def enqueue(self, url, metadata=None):
+        """
+        将URL和可选的元数据加入所属分片的队列
+        """
+        client, (queue_key, _, _) = self._route(url)
+        client.rpush(queue_key, self._encode(url, metadata))
+
+    def enqueue_batch(self, items):
+        """
+        批量加入队列（不去重），每个节点一次 pipeline
+        :param items: (url, metadata) 元组列表
+        """
+        self.reload_ring()
+        pipes = {}
+        for url, metadata in items:
+            partition = self.partition_for(url)
+            owner = self.owners[partition]
+            if owner not in pipes:
+                pipes[owner] = self.clients[owner].pipeline(transaction=False)
+            pipes[owner].rpush(self._keys(partition)[0], self._encode(url, metadata))
+        for pipe in pipes.values():
+            pipe.execute()
+
+    def enqueue_with_dedup(self, url, metadata=None):
+        """
+        同时去重和加入队列，URL 先规范化并记入发现链接集合，之后从页面中发现同一链接时不会重复入队
+        """
+        url = canonicalize_seed(url)
+        client, (queue_key, processed_key, _) = self._route(url)
+        client.sadd(self._discovered_key(self.partition_for(url)), url)
+        if not client.sadd(processed_key, url):
+            print(f"URL {url} already processed, skipping...")
+            return
+        client.rpush(queue_key, self._encode(url, metadata))
+
+    def enqueue_batch_with_dedup(self, items):
+        """
+        批量去重并加入队列，按节点分组后每个节点使用两次 pipeline
+        按永久的发现链接集合去重，已抓取并确认完成的 URL 不会再次入队
+        :param items: (url, metadata) 元组列表
+        :return: 实际加入队列的URL数量
+        """
+        self.reload_ring()
+        by_node = {}
+        for url, metadata in items:
+            partition = self.partition_for(url)
+            by_node.setdefault(self.owners[partition], []).append((url, metadata, partition))
+
+        count = 0
+        for name, node_items in by_node.items():
+            client = self.clients[name]
+            pipe = client.pipeline(transaction=False)
+            for url, _, partition in node_items:
+                pipe.sadd(self._discovered_key(partition), url)
+            added = pipe.execute()
+
+            pipe = client.pipeline(transaction=False)
+            node_count = 0
+            for (url, metadata, partition), is_new in zip(node_items, added):
+                if is_new:
+                    queue_key, processed_key, _ = self._keys(partition)
+                    pipe.rpush(queue_key, self._encode(url, metadata))
+                    pipe.sadd(processed_key, url)
+                    node_count += 1
+            if node_count:
+                pipe.execute()
+            count += node_count
+        return count
+
+    def mark_discovered(self, urls):
+        """
+        将 URL 记入所属分区的发现链接集合（如正在抓取的页面），之后发现这些链接时不再入队
+        :param urls: 规范化后的 URL 列表
+        """
+        self.reload_ring()
+        pipes = {}
+        for url in urls:
+            partition = self.partition_for(url)
+            owner = self.owners[partition]
+            if owner not in pipes:
+                pipes[owner] = self.clients[owner].pipeline(transaction=False)
+            pipes[owner].sadd(self._discovered_key(partition), url)
+        for pipe in pipes.values():
+            pipe.execute()
+
+    def _poll_order(self):
+        """
+        轮转节点和分区顺序，保证各分片被公平轮询
+        """
+        self.reload_ring()
+        names = [name for name in self.clients if self.node_partitions[name]]
+        self._rotation += 1
+        if not names:
+            return []
+        shift = self._rotation % len(names)
+        order = []
+        for name in names[shift:] + names[:shift]:
+            partitions = self.node_partitions[name]
+            offset = self._rotation % len(partitions)
+            keys = [self._keys(p)[0] for p in partitions[offset:] + partitions[:offset]]
+            order.append((self.clients[name], keys))
+        return order
+
+    def dequeue_blocking(self, timeout=5):
+        """
+        从各分片中公平地取出一个任务，在每个节点上用多键 BLPOP 同时等待该节点的所有分区
+        :param timeout: 总超时时间（秒）
+        :return: URL及其元数据的字典，超时返回None
+        """
+        deadline = time.time() + timeout
+        while True:
+            for client, keys in self._poll_order():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                item = client.blpop(keys, timeout=min(self.poll_slice, remaining))
+                if item:
+                    task = decode_or_quarantine(self.codec, client, item[1], self.quarantine_queue)
+                    if task is not None:
+                        return task
+
+    def dequeue(self):
+        """
+        从队列中取出一个URL及其元数据，每个节点只轮询一次
+        :return: URL及其元数据的字典，如果没有数据则返回None
+        """
+        for client, keys in self._poll_order():
+            item = client.blpop(keys, timeout=self.poll_slice)
+            if item:
+                task = decode_or_quarantine(self.codec, client, item[1], self.quarantine_queue)
+                if task is not None:
+                    return task
+        return None
+
+    def peek(self):
+        """
+        查看第一个非空分片队列头部的元素，但不移除它
+        """
+        for client, keys in self._poll_order():
+            for key in keys:
+                item = client.lindex(key, 0)
+                if item:
+                    return self.codec.decode(item)
+        return None
+
+    def size(self):
+        """
+        获取所有分片队列中元素的总数
+        """
+        self.reload_ring()
+        total = 0
+        for name, partitions in self.node_partitions.items():
+            pipe = self.clients[name].pipeline(transaction=False)
+            for partition in partitions:
+                pipe.llen(self._keys(partition)[0])
+            total += sum(pipe.execute())
+        return total
+
+    def clear(self):
+        """
+        清空所有分片的队列、去重集合、发现链接集合和处理中列表
+        """
+        for name, partitions in self.node_partitions.items():
+            keys = [key for partition in partitions
+                    for key in (*self._keys(partition), self._discovered_key(partition))]
+            if keys:
+                self.clients[name].delete(*keys)
+
+    def distribute_tasks(self, num_tasks=10):
+        """
+        从各分片轮流取出任务移入对应分片的处理中列表
+        """
+        self.reload_ring()
+        tasks = []
+        active = [(self.clients[owner], self._keys(p)) for p, owner in enumerate(self.owners)]
+        while active and len(tasks) < num_tasks:
+            still_active = []
+            for client, (queue_key, _, processing_key) in active:
+                if len(tasks) >= num_tasks:
+                    break
+                task = client.rpoplpush(queue_key, processing_key)
+                if task:
+                    decoded = decode_or_quarantine(self.codec, client, task, self.quarantine_queue)
+                    if decoded is None:
+                        client.lrem(processing_key, 1, task)
+                    else:
+                        tasks.append(decoded)
+                    still_active.append((client, (queue_key, _, processing_key)))
+            active = still_active
+        return tasks
+
+    def acknowledge_completion(self, task):
+        """
+        确认任务完成，并从所属分片的处理中列表中移除
+        """
+        url = task['url']
+        client, (_, processed_key, processing_key) = self._route(url)
+        client.srem(processed_key, url)
+        for payload in self.codec.encodings(task):
+            if client.lrem(processing_key, 0, payload):
+                break
+
+    def add_node(self, node, batch_size=1000, settle=None):
+        """
+        加入新节点并重新平衡：归属发生变化的分区，其队列、去重集合、发现链接集合和处理中列表整体迁移到新节点
+        先发布新的节点列表并等待 settle 秒，让其他进程的生产者和消费者都切换到新哈希环，再迁移旧数据，
+        切换前写入旧节点的任务也随之迁移，不会滞留在已无人轮询的分区中
+        :param node: 新节点（格式同构造参数）
+        :param batch_size: 每批迁移的元素数量
+        :param settle: 发布后等待的秒数，默认为 ring_check_interval
+        :return: 迁移的分区数量
+        """
+        self.reload_ring(force=True)
+        old_owners = self.owners
+        name = self._connect(node)
+        self.ring_version += 1
+        self._assign_partitions()
+        self._publish_ring()
+        time.sleep(self.ring_check_interval if settle is None else settle)
+        moved = 0
+        for partition, (old, new) in enumerate(zip(old_owners, self.owners)):
+            if old == new:
+                continue
+            self._migrate_partition(self.clients[old], self.clients[new], partition, batch_size)
+            moved += 1
+        print(f"Node {name} added, {moved} partitions migrated.")
+        return moved
+
+    def _migrate_partition(self, source, target, partition, batch_size):
+        queue_key, processed_key, processing_key = self._keys(partition)
+        for key in (queue_key, processing_key):
+            # 先复制到目标节点再从源节点删除，中途出错时任务仍在源节点上，至多重复而不会丢失
+            while True:
+                items = source.lrange(key, 0, batch_size - 1)
+                if not items:
+                    break
+                target.rpush(key, *items)
+                source.ltrim(key, len(items), -1)
+        for set_key in (processed_key, self._discovered_key(partition)):
+            cursor = 0
+            while True:
+                cursor, members = source.sscan(set_key, cursor, count=batch_size)
+                if members:
+                    target.sadd(set_key, *members)
+                if cursor == 0:
+                    break
+            source.delete(set_key)
@@ -0,0 +1,59 @@
+# 工作进程启动时间基准
+## 使用 `python -X importtime` 测量导入 data_extraction_and_cleaning 的耗时，
+## 超过阈值时以非零状态退出，可在 CI 中运行。
+
+import sys
+import argparse
+import subprocess
+
+
+def measure_import(module, runs=5, env=None):
+    """
+    在全新的解释器中多次导入模块，解析 -X importtime 输出
+    :param module: 要导入的模块名
+    :param runs: 运行次数
+    :param env: 子进程的环境变量，默认继承当前环境
+    :return: (每次运行的累计导入耗时（微秒）列表, 最后一次运行中耗时最多的模块列表)
+    """
+    totals = []
+    entries = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, env=env
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+        entries = []
+        for line in proc.stderr.splitlines():
+            # 格式: import time: self [us] | cumulative | imported package
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            entries.append((int(cumulative_us), int(self_us), name.rstrip()))
+        top_level = [e for e in entries if e[2].strip() == module]
+        totals.append(top_level[-1][0] if top_level else 0)
+    entries.sort(reverse=True)
+    return totals, entries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Worker startup-time benchmark")
+    parser.add_argument('--module', type=str, default='data_extraction_and_cleaning', help='Module to import')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreter runs')
+    parser.add_argument('--max_ms', type=float, default=300, help='Fail if the median import time exceeds this (ms)')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to show')
+    args = parser.parse_args()
+
+    totals, entries = measure_import(args.module, args.runs)
+    median_ms = sorted(totals)[len(totals) // 2] / 1000
+    print(f"import {args.module}: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(totals) / 1000:.1f} ms, max {max(totals) / 1000:.1f} ms)")
+    print(f"{'cumulative [ms]':>16} {'self [ms]':>10}  module")
+    for cumulative_us, self_us, name in entries[:args.top]:
+        print(f"{cumulative_us / 1000:>16.1f} {self_us / 1000:>10.1f}  {name}")
+
+    if median_ms > args.max_ms:
+        print(f"FAIL: median import time {median_ms:.1f} ms exceeds {args.max_ms} ms")
+        sys.exit(1)
+    print("OK")
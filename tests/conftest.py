@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 项目模块位于仓库根目录
+sys.path.insert(0, ROOT)
+
+# 仓库中不包含 config.py，测试使用一个最小配置
+STUB_CONFIG = (
+    "MONGO_URI = 'mongodb://localhost:27017/'\n"
+    "MONGO_DB = 'web_crawler'\n"
+    "MONGO_TABLE = 'scraped_data'\n"
+    "USER_AGENT = ['Mozilla/5.0']\n"
+    "KEYWORD = 'test'\n"
+    "COOKIE = ''\n"
+)
+
+
+@pytest.fixture(scope='session')
+def stub_config_dir(tmp_path_factory):
+    """
+    写有最小 config.py 的目录
+    """
+    path = tmp_path_factory.mktemp('stub_config')
+    (path / 'config.py').write_text(STUB_CONFIG, encoding='utf-8')
+    return path
+
+
+@pytest.fixture(scope='session')
+def worker_module(stub_config_dir):
+    """
+    在当前进程中导入 data_extraction_and_cleaning（使用最小配置）
+    """
+    sys.path.insert(0, str(stub_config_dir))
+    import data_extraction_and_cleaning
+    return data_extraction_and_cleaning
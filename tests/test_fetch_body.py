@@ -0,0 +1,85 @@
+import io
+import gzip
+import zlib
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
+
+
+def make_response(body, content_encoding=None, content_length=None):
+    """
+    构造一个以 stream=True 发起、尚未读取响应体的响应
+    """
+    headers = CaseInsensitiveDict()
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    if content_length is not None:
+        headers['Content-Length'] = str(content_length)
+    response = requests.Response()
+    response.status_code = 200
+    response.headers = headers
+    response.raw = HTTPResponse(body=io.BytesIO(body), headers=dict(headers), preload_content=False,
+                                decode_content=False)
+    return response
+
+
+def raw_deflate(data):
+    obj = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return obj.compress(data) + obj.flush()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 100, 64 * 1024])
+def test_multi_member_gzip(worker_module, monkeypatch, chunk_size):
+    monkeypatch.setattr(worker_module, 'RESPONSE_CHUNK_SIZE', chunk_size)
+    body = gzip.compress(b'a' * 10) + gzip.compress(b'b' * 10) + gzip.compress(b'c' * 10)
+    assert worker_module.read_limited_body(make_response(body, 'gzip')) == b'a' * 10 + b'b' * 10 + b'c' * 10
+
+
+def test_gzip_trailing_padding_is_ignored(worker_module):
+    body = gzip.compress(b'a' * 10) + gzip.compress(b'b' * 10) + b'\x00' * 8
+    assert worker_module.read_limited_body(make_response(body, 'gzip')) == b'a' * 10 + b'b' * 10
+
+
+@pytest.mark.parametrize('encode', [zlib.compress, raw_deflate])
+def test_deflate_with_and_without_zlib_header(worker_module, encode):
+    data = b'<html>' + b'x' * 5000 + b'</html>'
+    assert worker_module.read_limited_body(make_response(encode(data), 'deflate')) == data
+
+
+@pytest.mark.parametrize('encoding', [None, 'gzip', 'deflate'])
+def test_body_of_exactly_max_bytes_is_accepted(worker_module, encoding):
+    data = b'x' * 1000
+    body = {None: data, 'gzip': gzip.compress(data), 'deflate': zlib.compress(data)}[encoding]
+    assert worker_module.read_limited_body(make_response(body, encoding), max_bytes=1000) == data
+
+
+@pytest.mark.parametrize('encoding', [None, 'gzip', 'deflate'])
+def test_body_one_byte_over_max_bytes_is_rejected(worker_module, encoding):
+    data = b'x' * 1001
+    body = {None: data, 'gzip': gzip.compress(data), 'deflate': zlib.compress(data)}[encoding]
+    with pytest.raises(worker_module.ResponseRejected):
+        worker_module.read_limited_body(make_response(body, encoding), max_bytes=1000)
+
+
+def test_multi_member_gzip_over_max_bytes_is_rejected(worker_module):
+    body = gzip.compress(b'a' * 600) + gzip.compress(b'b' * 600)
+    with pytest.raises(worker_module.ResponseRejected):
+        worker_module.read_limited_body(make_response(body, 'gzip'), max_bytes=1000)
+
+
+def test_content_length_over_max_bytes_is_rejected_before_reading(worker_module):
+    with pytest.raises(worker_module.ResponseRejected):
+        worker_module.read_limited_body(make_response(b'', content_length=1001), max_bytes=1000)
+
+
+def test_json_in_declared_charset(worker_module):
+    page = worker_module.RawPage('{"a":"中文"}'.encode('gbk'), 'GBK', 'application/json;charset=GBK')
+    assert worker_module.decode_page(page) == {'a': '中文'}
+
+
+def test_json_in_utf8(worker_module):
+    page = worker_module.RawPage('{"a":"中文"}'.encode('utf-8'), 'utf-8', 'application/json; charset=utf-8')
+    assert worker_module.decode_page(page) == {'a': '中文'}
+    assert worker_module.decode_page(page._replace(encoding=None)) == {'a': '中文'}
@@ -0,0 +1,94 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from http_pool import ConnectionManager
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """
+    对任意路径（包括代理形式的绝对 URL）返回一个小响应，保持长连接
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def pool_for(manager, url, proxies=None):
+    adapter = manager.session().get_adapter(url)
+    request = requests.Request('GET', url).prepare()
+    return adapter.get_connection_with_tls_context(request, True, proxies)
+
+
+@pytest.mark.parametrize('thread_local', [True, False])
+def test_pool_size_per_host(thread_local):
+    manager = ConnectionManager(pool_sizes={'a.test': 3}, default_pool_size=5, thread_local=thread_local)
+    assert pool_for(manager, 'http://a.test/x').pool.maxsize == 3
+    assert pool_for(manager, 'http://b.test/x').pool.maxsize == 5
+
+
+@pytest.mark.parametrize('thread_local', [True, False])
+def test_pool_size_per_proxy_overrides_target_host(thread_local):
+    proxy = 'http://10.0.0.1:8080'
+    manager = ConnectionManager(pool_sizes={'a.test': 3}, proxy_pool_sizes={proxy: 7},
+                                default_proxy_pool_size=4, thread_local=thread_local)
+    assert pool_for(manager, 'http://a.test/x', {'http': proxy}).pool.maxsize == 7
+    assert pool_for(manager, 'http://a.test/x', {'http': '10.0.0.2:8080'}).pool.maxsize == 4
+    # 不经代理时仍按目标主机
+    assert pool_for(manager, 'http://a.test/x').pool.maxsize == 3
+
+
+def test_connections_are_reused(server):
+    manager = ConnectionManager()
+    session = manager.session()
+    for _ in range(20):
+        assert session.get(server + '/page', timeout=5).text == 'ok'
+    stats = manager.stats()
+    assert stats['requests'] == 20
+    assert stats['connections'] == 1
+    assert stats['reuse_ratio'] == pytest.approx(0.95)
+
+
+def test_connections_through_proxy_are_reused(server):
+    proxy_sizes = {server: 2}
+    manager = ConnectionManager(proxy_pool_sizes=proxy_sizes, pool_sizes={'a.test': 9})
+    session = manager.session()
+    for i in range(10):
+        assert session.get(f"http://a.test/{i}", proxies={'http': server}, timeout=5).text == 'ok'
+    adapter = session.get_adapter('http://a.test/')
+    (pool,) = [adapter.proxy_manager[server].pools[key] for key in adapter.proxy_manager[server].pools.keys()]
+    assert pool.pool.maxsize == 2
+    stats = manager.stats()
+    assert stats['requests'] == 10
+    assert stats['reuse_ratio'] == pytest.approx(0.9)
+
+
+def test_idle_pools_are_evicted(server):
+    manager = ConnectionManager(idle_timeout=0)
+    session = manager.session()
+    session.get(server + '/page', timeout=5)
+    assert manager.evict_idle() == 1
+    stats = manager.stats()
+    assert stats['pools'] == 0
+    assert stats['requests'] == 1
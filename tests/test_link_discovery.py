@@ -0,0 +1,74 @@
+import fakeredis
+import pytest
+from bs4 import BeautifulSoup
+
+import redis_url_queue
+from link_discovery import LinkDiscoverer, URLCanonicalizer
+from sharded_queue import ShardedURLQueue
+
+PAGE = """
+<html><body>
+  <a href="/">home</a>
+  <a href="/page/2/?utm_source=x#top">next</a>
+  <a href="/page/2">next again</a>
+  <a href="https://other.example/">elsewhere</a>
+  <a href="/login" rel="nofollow">login</a>
+</body></html>
+"""
+
+
+@pytest.fixture(params=['single', 'sharded'])
+def queue(request, monkeypatch):
+    server = fakeredis.FakeServer()
+    if request.param == 'single':
+        monkeypatch.setattr(redis_url_queue.redis, 'Redis',
+                            lambda **kwargs: fakeredis.FakeRedis(server=server))
+        return redis_url_queue.RedisURLQueue(codec='json')
+    return ShardedURLQueue(['node1', 'node2'], codec='json',
+                           client_factory=lambda host, port, db: fakeredis.FakeRedis(server=server))
+
+
+def drain(queue):
+    tasks = []
+    while True:
+        task = queue.dequeue()
+        if task is None:
+            return tasks
+        tasks.append(task)
+
+
+def test_canonicalize():
+    canonicalizer = URLCanonicalizer()
+    assert canonicalizer.canonicalize('HTTPS://Quotes.toscrape.com:443/page/2/?b=1&a=2&utm_medium=x#f') == \
+        'https://quotes.toscrape.com/page/2?a=2&b=1'
+    assert canonicalizer.canonicalize('mailto:someone@example.com') is None
+
+
+def test_page_linking_to_itself_is_not_requeued(queue):
+    queue.enqueue_with_dedup('https://quotes.toscrape.com/')
+    (task,) = drain(queue)
+    queue.acknowledge_completion(task)
+
+    discoverer = LinkDiscoverer(queue)
+    soup = BeautifulSoup(PAGE, 'lxml')
+    assert discoverer.discover(soup, task['url'], 0) == 1
+    assert [t['url'] for t in drain(queue)] == ['https://quotes.toscrape.com/page/2']
+
+    # 其他工作进程（没有本地去重记录）再次发现同一页面的链接
+    assert LinkDiscoverer(queue).discover(soup, task['url'], 0) == 0
+    assert drain(queue) == []
+
+
+def test_seed_is_canonicalized(queue):
+    queue.enqueue_with_dedup('https://Quotes.toscrape.com/page/3/?utm_source=mail')
+    (task,) = drain(queue)
+    assert task['url'] == 'https://quotes.toscrape.com/page/3'
+    queue.acknowledge_completion(task)
+    soup = BeautifulSoup('<a href="/page/3/">again</a>', 'lxml')
+    assert LinkDiscoverer(queue).discover(soup, 'https://quotes.toscrape.com/', 0) == 0
+
+
+def test_max_depth(queue):
+    soup = BeautifulSoup(PAGE, 'lxml')
+    assert LinkDiscoverer(queue, max_depth=1).discover(soup, 'https://quotes.toscrape.com/', 1) == 0
+    assert drain(queue) == []
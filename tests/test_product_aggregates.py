@@ -0,0 +1,74 @@
+import fakeredis
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import product_aggregates
+from product_aggregates import (pause_if_rebuilding, rollup_batch, format_rollup, PENDING_FIELD, PENDING_KEY,
+                                REBUILDING_KEY, ALL)
+
+ITEMS = [
+    {'标题': 'a', '原价': 10, '最低批发价': '8', '销售量': '1.2万', '省份': '浙江', '城市': '杭州', '公司': 'x'},
+    {'标题': 'b', '原价': '面议', '最低批发价': 4, '销售量': 3, '省份': '浙江', '城市': '宁波', '公司': 'y'},
+]
+
+
+def test_averages_only_count_parsed_prices():
+    acc = rollup_batch(ITEMS)[f"province:浙江"]
+    doc = dict(acc, dimension='province', value='浙江')
+    result = format_rollup(doc)
+    assert result['count'] == 2
+    assert result['price']['avg'] == 10
+    assert result['wholesale_price']['avg'] == 6
+    assert result['sales'] == 12003
+
+
+def test_not_paused_without_rebuild():
+    client = fakeredis.FakeRedis()
+    items = [dict(item) for item in ITEMS]
+    assert not pause_if_rebuilding(client, 'products', items)
+    assert all(PENDING_FIELD not in item for item in items)
+    assert client.llen(PENDING_KEY.format('products')) == 0
+
+
+def test_paused_during_rebuild_marks_and_journals_before_insert():
+    client = fakeredis.FakeRedis()
+    client.set(REBUILDING_KEY.format('products'), 1)
+    items = [dict(item) for item in ITEMS]
+    assert pause_if_rebuilding(client, 'products', items)
+    assert all(item[PENDING_FIELD] is True and isinstance(item['_id'], ObjectId) for item in items)
+    journal = client.lrange(PENDING_KEY.format('products'), 0, -1)
+    assert journal == [str(item['_id']).encode() for item in items]
+
+
+class FakeCollection:
+    """
+    insert_many(ordered=False) 中第一个商品因唯一索引冲突失败
+    """
+
+    def __init__(self):
+        self.inserted = []
+
+    def insert_many(self, docs, ordered=True):
+        assert not ordered
+        self.inserted.extend(docs[1:])
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'duplicate key'}],
+                              'nInserted': len(docs) - 1})
+
+
+def test_partial_insert_failure_still_updates_rollups(worker_module, monkeypatch):
+    collection = FakeCollection()
+    rolled_up = []
+    bumped = []
+    monkeypatch.setattr(worker_module, 'get_db', lambda: {worker_module.MONGO_TABLE: collection})
+    monkeypatch.setattr(worker_module, 'get_redis', lambda: fakeredis.FakeRedis())
+    monkeypatch.setattr(product_aggregates, 'update_aggregates', lambda db, table, items: rolled_up.extend(items))
+    monkeypatch.setattr('result_cache.bump_collection_version', lambda client, table: bumped.append(table))
+
+    worker_module.save_to_mongo([dict(item) for item in ITEMS])
+    assert [item['标题'] for item in rolled_up] == ['b']
+    assert bumped == [worker_module.MONGO_TABLE]
+
+
+def test_rollup_of_all_dimension():
+    assert rollup_batch(ITEMS)[f"{ALL}:{ALL}"]['count'] == 2
@@ -0,0 +1,86 @@
+import time
+
+import fakeredis
+import pytest
+
+from rate_control import AdaptiveRateController, HOST_STATE_KEY
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_controller(server, **kwargs):
+    """
+    每个控制器相当于一个工作进程，共享同一个 Redis
+    """
+    controller = AdaptiveRateController(redis_client=fakeredis.FakeRedis(server=server), **kwargs)
+    controller.worker_name += f":{id(controller)}"
+    return controller
+
+
+def test_concurrency_is_shared_between_workers(server):
+    a = make_controller(server, initial_concurrency=2, initial_rate=1000)
+    b = make_controller(server, initial_concurrency=2, initial_rate=1000)
+    assert a.acquire('example.com', timeout=0)
+    assert b.acquire('example.com', timeout=0)
+    # 两个进程各持有一个许可，集群的并发数已满
+    assert not a.acquire('example.com', timeout=0)
+    assert not b.acquire('example.com', timeout=0)
+    assert b.wait_time('example.com') > 0
+    a.cancel('example.com')
+    assert b.acquire('example.com', timeout=0)
+
+
+def test_rate_is_shared_between_workers(server):
+    workers = [make_controller(server, initial_concurrency=32, initial_rate=10) for _ in range(4)]
+    start = time.time()
+    granted = 0
+    while time.time() - start < 0.5:
+        for worker in workers:
+            if worker.acquire('example.com', timeout=0):
+                granted += 1
+                worker.cancel('example.com')
+    # 四个进程合计仍按 10 次/秒发送，而不是 40 次/秒
+    assert granted <= 7
+
+
+def test_throttling_seen_by_one_worker_slows_all(server):
+    a = make_controller(server, initial_rate=1000)
+    b = make_controller(server, initial_rate=1000)
+    assert a.acquire('example.com', timeout=0)
+    a.release('example.com', 429, 0.1, '600')
+    assert not b.acquire('example.com', timeout=0.1)
+    assert b.wait_time('example.com') > 500
+    assert a.snapshot()['example.com']['rate'] == 500
+    assert float(fakeredis.FakeRedis(server=server).hget(HOST_STATE_KEY, 'example.com|rate')) == 500
+
+
+def test_successes_increase_the_shared_limits(server):
+    a = make_controller(server, initial_concurrency=2, initial_rate=1000)
+    b = make_controller(server, initial_concurrency=2, initial_rate=1000)
+    for worker in (a, b, a, b):
+        assert worker.acquire('example.com', timeout=1)
+        worker.release('example.com', 200, 0.1)
+    assert b.snapshot()['example.com']['requests'] == 4
+    assert b.snapshot()['example.com']['concurrency'] == 2
+    assert b.hosts['example.com'].concurrency > 2.8
+
+
+def test_expired_lease_is_reclaimed(server):
+    a = make_controller(server, initial_concurrency=1, initial_rate=1000, permit_lease=0.1)
+    b = make_controller(server, initial_concurrency=1, initial_rate=1000)
+    assert a.acquire('example.com', timeout=0)
+    # a 崩溃，没有归还许可
+    assert not b.acquire('example.com', timeout=0)
+    assert b.acquire('example.com', timeout=1)
+
+
+def test_local_mode_without_redis():
+    controller = AdaptiveRateController(initial_concurrency=1, initial_rate=1000)
+    assert controller.acquire('example.com', timeout=0)
+    assert not controller.acquire('example.com', timeout=0)
+    controller.release('example.com', 503, 0.1, '30')
+    assert controller.wait_time('example.com') > 25
+    assert not controller.acquire('example.com', timeout=0)
@@ -0,0 +1,30 @@
+import fakeredis
+
+from result_cache import ResultCache, bump_collection_version
+
+
+def test_whitespace_is_ignored_in_ordinary_params():
+    cache = ResultCache('products')
+    calls = []
+    for page in (' 2', '2 '):
+        cache.get_or_compute('get', {'page': page}, lambda: calls.append(page) or len(calls))
+    assert calls == [' 2']
+
+
+def test_verbatim_params_keep_their_whitespace():
+    cache = ResultCache('products')
+    results = {query: cache.get_or_compute('search', {'query': query}, lambda q=query: f"matches for {q!r}",
+                                           verbatim=('query',))
+               for query in (' foo', 'foo ', 'foo')}
+    assert results == {' foo': "matches for ' foo'", 'foo ': "matches for 'foo '", 'foo': "matches for 'foo'"}
+    assert cache.get_stats()['misses'] == 3
+
+
+def test_shared_cache_is_invalidated_by_version_bump():
+    client = fakeredis.FakeRedis()
+    writer_view = ResultCache('products', redis_client=client, version_check_interval=0)
+    reader = ResultCache('products', redis_client=client, version_check_interval=0)
+    assert writer_view.get_or_compute('get', {'page': 1}, lambda: ['old']) == ['old']
+    assert reader.get_or_compute('get', {'page': 1}, lambda: ['unused']) == ['old']
+    bump_collection_version(client, 'products')
+    assert reader.get_or_compute('get', {'page': 1}, lambda: ['new']) == ['new']
@@ -0,0 +1,69 @@
+import json
+
+import fakeredis
+import pytest
+
+import redis_url_queue
+from retry_queue import RetryQueue
+from serialization import Codec, QUEUE_CODEC, QUARANTINE_QUEUE, FORMAT_MSGPACK
+
+TASK = {'url': 'https://example.com/中文', 'metadata': {'depth': 1, 'parent': 'https://example.com/'}}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def make_queue(server, monkeypatch):
+    monkeypatch.setattr(redis_url_queue.redis, 'Redis', lambda **kwargs: fakeredis.FakeRedis(server=server))
+    return lambda **kwargs: redis_url_queue.RedisURLQueue(**kwargs)
+
+
+def test_queue_payloads_default_to_msgpack(make_queue):
+    assert QUEUE_CODEC == 'msgpack'
+    queue = make_queue()
+    queue.enqueue(TASK['url'], TASK['metadata'])
+    payload = queue.redis_client.lindex(queue.queue_name, 0)
+    assert payload[:1] == FORMAT_MSGPACK
+    assert len(payload) < len(json.dumps(TASK).encode('utf-8'))
+
+
+@pytest.mark.parametrize('name', ['json', 'orjson', 'msgpack'])
+def test_every_codec_decodes_every_format(name):
+    payloads = [Codec(other).encode(TASK) for other in ('json', 'orjson', 'msgpack')]
+    payloads.append(json.dumps(TASK).encode('utf-8'))  # 不带格式字节的旧载荷
+    assert [Codec(name).decode(payload) for payload in payloads] == [TASK] * 4
+
+
+def test_mixed_producers_and_consumer(make_queue):
+    json_producer = make_queue(codec='json')
+    consumer = make_queue()
+    json_producer.enqueue_with_dedup('https://a.example/', {'depth': 0})
+    consumer.enqueue_with_dedup('https://b.example/', {'depth': 0})
+    consumer.redis_client.rpush(consumer.queue_name, json.dumps({'url': 'https://c.example/'}))  # 旧版生产者
+
+    tasks = consumer.distribute_tasks(10)
+    assert sorted(task['url'] for task in tasks) == ['https://a.example/', 'https://b.example/', 'https://c.example/']
+    # 按值确认时能找到由其他编解码写入处理队列的载荷
+    for task in tasks:
+        consumer.acknowledge_completion(task)
+    assert consumer.redis_client.llen('processing_queue') == 0
+
+
+def test_undecodable_payload_is_quarantined(make_queue):
+    queue = make_queue()
+    queue.redis_client.rpush(queue.queue_name, b'\x7fgarbage', Codec().encode(TASK))
+    assert queue.dequeue() == TASK
+    assert queue.redis_client.lrange(QUARANTINE_QUEUE, 0, -1) == [b'\x7fgarbage']
+
+
+def test_retry_set_uses_the_queue_codec(make_queue, server):
+    queue = make_queue()
+    retry_queue = RetryQueue(queue, fakeredis.FakeRedis(server=server))
+    retry_queue.defer(TASK, 0)
+    retry_queue.redis_client.zadd(retry_queue.retry_set, {Codec('json').encode({'url': 'https://d.example/'}): 0})
+    assert Codec('msgpack').encode(TASK) in retry_queue.redis_client.zrange(retry_queue.retry_set, 0, -1)
+    assert retry_queue.promote_due() == 2
+    assert sorted(task['url'] for task in (queue.dequeue(), queue.dequeue())) == ['https://d.example/', TASK['url']]
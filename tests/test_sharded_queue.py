@@ -0,0 +1,147 @@
+import fakeredis
+import redis
+import pytest
+
+from sharded_queue import ShardedURLQueue, node_name, parse_node
+
+
+@pytest.fixture
+def servers():
+    """
+    每个节点名对应一个独立的 fakeredis 服务器
+    """
+    return {}
+
+
+@pytest.fixture
+def make_queue(servers):
+    def client_factory(host, port, db):
+        server = servers.setdefault(node_name(host, port, db), fakeredis.FakeServer())
+        return fakeredis.FakeRedis(server=server)
+
+    def make(nodes, **kwargs):
+        kwargs.setdefault('codec', 'json')
+        kwargs.setdefault('poll_slice', 0.01)
+        return ShardedURLQueue(nodes, client_factory=client_factory, **kwargs)
+    return make
+
+
+def test_node_names_are_normalized():
+    assert parse_node('localhost') == ('localhost', 6379, 0)
+    assert parse_node('redis://10.0.0.1:6380/2') == ('10.0.0.1', 6380, 2)
+    assert node_name(*parse_node('localhost:6379')) == node_name(*parse_node('localhost:6379/0'))
+
+
+def test_equivalent_node_lists_build_the_same_ring(make_queue):
+    a = make_queue(['node1:6379', 'node2:6379'])
+    b = make_queue(['node1:6379/0', 'node2'])
+    assert sorted(a.clients) == sorted(b.clients) == ['node1:6379/0', 'node2:6379/0']
+    assert a.owners == b.owners
+
+
+def test_urls_of_one_host_route_to_one_partition(make_queue):
+    queue = make_queue(['node1', 'node2', 'node3'])
+    partition = queue.partition_for('https://Example.com/a')
+    assert queue.partition_for('https://example.com/b?x=1') == partition
+    assert queue.client_for('https://example.com/c') is queue.clients[queue.owners[partition]]
+    assert all(queue.node_partitions.values())
+
+
+def test_dedup_and_ack(make_queue):
+    queue = make_queue(['node1', 'node2'])
+    urls = [f"https://host{i}.com/" for i in range(20)]
+    assert queue.enqueue_batch_with_dedup([(url, None) for url in urls]) == 20
+    assert queue.enqueue_batch_with_dedup([(url, None) for url in urls]) == 0
+    tasks = queue.distribute_tasks(20)
+    assert sorted(task['url'] for task in tasks) == sorted(urls)
+    for task in tasks:
+        queue.acknowledge_completion(task)
+    # 确认完成后再次发现同一链接也不会重新入队
+    assert queue.enqueue_batch_with_dedup([(url, None) for url in urls]) == 0
+    assert queue.size() == 0
+
+
+def test_polling_is_fair_across_nodes(make_queue):
+    queue = make_queue(['node1', 'node2'])
+    by_node = {name: [] for name in queue.clients}
+    i = 0
+    while min(len(urls) for urls in by_node.values()) < 10:
+        url = f"https://host{i}.com/"
+        by_node[queue.owners[queue.partition_for(url)]].append(url)
+        i += 1
+    for urls in by_node.values():
+        queue.enqueue_batch([(url, None) for url in urls[:10]])
+
+    owners = [queue.owners[queue.partition_for(queue.dequeue()['url'])] for _ in range(10)]
+    # 两个节点都有任务时，连续出队交替轮询两个节点
+    assert set(owners) == set(queue.clients)
+    assert all(a != b for a, b in zip(owners, owners[1:]))
+
+
+def test_add_node_migrates_partitions_and_other_processes_follow(make_queue):
+    producer = make_queue(['node1', 'node2'], ring_check_interval=0)
+    consumer = make_queue(['node1', 'node2'], ring_check_interval=0)
+    urls = [f"https://host{i}.com/" for i in range(200)]
+    producer.enqueue_batch([(url, {'depth': 1}) for url in urls])
+
+    assert producer.add_node('node3', settle=0) > 0
+
+    # 消费者轮询时读取到新发布的节点列表，迁移到新节点的分区不会被遗漏
+    received = []
+    while True:
+        task = consumer.dequeue()
+        if task is None:
+            break
+        received.append(task['url'])
+    assert 'node3:6379/0' in consumer.clients
+    assert consumer.owners == producer.owners
+    assert sorted(received) == sorted(urls)
+
+
+def test_new_process_uses_published_ring(make_queue):
+    first = make_queue(['node1', 'node2'])
+    first.add_node('node3', settle=0)
+    late = make_queue(['node1', 'node2'])
+    assert late.owners == first.owners
+    assert late.ring_version == first.ring_version == 1
+
+
+class FailingClient:
+    """
+    第 fail_on 次 RPUSH 时抛出连接错误，其余调用转发给真实客户端
+    """
+
+    def __init__(self, client, fail_on):
+        self.client = client
+        self.fail_on = fail_on
+        self.calls = 0
+
+    def rpush(self, *args):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise redis.ConnectionError('injected failure')
+        return self.client.rpush(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def test_migration_failure_does_not_lose_tasks(make_queue, servers):
+    queue = make_queue(['node1', 'node2'])
+    partition = 0
+    queue_key, _, processing_key = queue._keys(partition)
+    source = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    target = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+    items = [f"task{i}".encode() for i in range(25)]
+    source.rpush(queue_key, *items)
+    source.rpush(processing_key, b'running')
+
+    with pytest.raises(redis.ConnectionError):
+        queue._migrate_partition(source, FailingClient(target, fail_on=2), partition, batch_size=10)
+    # 第一批已复制并从源节点删除，失败的第二批仍在源节点
+    assert target.lrange(queue_key, 0, -1) + source.lrange(queue_key, 0, -1) == items
+
+    queue._migrate_partition(source, target, partition, batch_size=10)
+    assert target.lrange(queue_key, 0, -1) == items
+    assert target.lrange(processing_key, 0, -1) == [b'running']
+    assert source.llen(queue_key) == source.llen(processing_key) == 0
@@ -0,0 +1,44 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from startup_benchmark import measure_import
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('pandas', 'bs4', 'pymongo', 'lxml')
+IMPORT_BUDGET_MS = 1000  # 比 startup_benchmark.py 默认阈值宽松，避免 CI 机器抖动导致误报
+
+
+@pytest.fixture
+def stub_env(stub_config_dir):
+    """
+    最小 config.py 放到子进程的 PYTHONPATH 中
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([str(stub_config_dir), ROOT])
+    return env
+
+
+def test_worker_import_is_light(stub_env):
+    totals, entries = measure_import('data_extraction_and_cleaning', runs=1, env=stub_env)
+    imported = {name.strip() for _, _, name in entries}
+    assert not imported & set(HEAVY_MODULES)
+    assert totals[0] / 1000 < IMPORT_BUDGET_MS
+
+
+def test_worker_import_is_offline(stub_env):
+    code = (
+        "import socket, sys\n"
+        "def offline(*args, **kwargs):\n"
+        "    raise AssertionError('network access during import')\n"
+        "socket.socket.connect = offline\n"
+        "socket.create_connection = offline\n"
+        "socket.getaddrinfo = offline\n"
+        "import data_extraction_and_cleaning\n"
+        f"print(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=stub_env)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout.strip() == '[]'
@@ -0,0 +1,88 @@
+import os
+import signal
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def launcher_module(worker_module, monkeypatch):
+    import worker_launcher
+    monkeypatch.setattr(worker_module, 'warm_imports', lambda: None)
+    previous = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    yield worker_launcher
+    for sig, handler in previous.items():
+        signal.signal(sig, handler)
+    worker_module._stop_requested.clear()
+
+
+class ListQueue:
+    def __init__(self, urls):
+        self.tasks = [{'url': url} for url in urls]
+        self.acked = []
+
+    def dequeue(self):
+        return self.tasks.pop(0) if self.tasks else None
+
+    def acknowledge_completion(self, task):
+        self.acked.append(task['url'])
+
+
+class NoRetries:
+    def promote_due(self):
+        return 0
+
+    def next_due_in(self):
+        return None
+
+
+def test_worker_loop_stops_between_tasks(worker_module, monkeypatch):
+    queue = ListQueue(['https://a.example/', 'https://b.example/'])
+
+    def process_url(url, rules, depth, discoverer):
+        worker_module.request_stop()  # 处理第一个任务时收到停止请求
+        return ['data']
+
+    monkeypatch.setattr(worker_module, 'process_url', process_url)
+    try:
+        worker_module._worker_loop(queue, NoRetries(), {}, None)
+    finally:
+        worker_module._stop_requested.clear()
+    # 当前任务完成并确认，之后不再取新任务
+    assert queue.acked == ['https://a.example/']
+    assert [task['url'] for task in queue.tasks] == ['https://b.example/']
+
+
+@pytest.mark.parametrize('exit_with', [None, 0])
+def test_successful_sys_exit_is_not_respawned(launcher_module, worker_module, monkeypatch, exit_with):
+    spawned = []
+    monkeypatch.setattr(worker_module, 'run_worker', lambda: (_ for _ in ()).throw(SystemExit(exit_with)))
+    launcher = launcher_module.PreforkLauncher(num_workers=2, respawn_delay=0)
+    original_spawn = launcher._spawn
+
+    def spawn(worker_id):
+        spawned.append(worker_id)
+        if len(spawned) >= 4:
+            launcher.running = False  # 被错误地重新拉起时不要无限循环
+        original_spawn(worker_id)
+
+    launcher._spawn = spawn
+    launcher.run()
+    assert sorted(spawned) == [0, 1]
+
+
+def test_sigterm_lets_workers_finish_and_clean_up(launcher_module, worker_module, monkeypatch, tmp_path):
+    def run_worker():
+        try:
+            while not worker_module._stop_requested.wait(0.05):
+                pass
+        finally:
+            (tmp_path / f"clean.{os.getpid()}").write_text('ok')
+
+    monkeypatch.setattr(worker_module, 'run_worker', run_worker)
+    launcher = launcher_module.PreforkLauncher(num_workers=2, respawn_delay=0)
+    timer = threading.Timer(0.5, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+    launcher.run()
+    timer.join()
+    assert len(list(tmp_path.glob('clean.*'))) == 2
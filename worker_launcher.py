@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+
+import data_extraction_and_cleaning
+
+
+def _stop_on_signal(signum, frame):
+    """
+    工作进程的终止信号处理：只设置停止标记，工作进程处理完当前任务后退出主循环并执行清理，
+    不在任意位置抛出异常（例如重试任务已从有序集合取出、尚未写回工作队列时）
+    """
+    logging.info(f"Worker pid {os.getpid()} received signal {signum}, stopping after the current task...")
+    data_extraction_and_cleaning.request_stop()
+
+
+class PreforkLauncher:
+    def __init__(self, num_workers=4, respawn_delay=1):
+        """
+        prefork 工作进程启动器：在父进程中一次性导入重量级库，再 fork 出工作进程，
+        工作进程异常退出后从已预热的父进程重新 fork，无需重复导入；
+        队列处理完毕正常退出（状态 0）的工作进程不再拉起，全部退出后启动器结束
+        :param num_workers: 工作进程数量
+        :param respawn_delay: 工作进程异常退出后重新 fork 前的等待时间（秒）
+        """
+        self.num_workers = num_workers
+        self.respawn_delay = respawn_delay
+        self.children = {}  # pid -> 工作进程编号
+        self.running = False
+
+    def _spawn(self, worker_id):
+        pid = os.fork()
+        if pid == 0:
+            # 子进程：收到终止信号时请求停止，run_worker 正常返回并在 finally 中保存去重集合等状态；
+            # 客户端在首次使用时各自创建
+            signal.signal(signal.SIGINT, _stop_on_signal)
+            signal.signal(signal.SIGTERM, _stop_on_signal)
+            code = 0
+            try:
+                data_extraction_and_cleaning.run_worker()
+            except SystemExit as e:
+                # 与解释器一致：sys.exit() 为成功，整数为退出状态，其他对象视为失败
+                code = 0 if e.code is None else (e.code if isinstance(e.code, int) else 1)
+            except Exception as e:
+                logging.error(f"Worker {worker_id} crashed: {e}")
+                code = 1
+            os._exit(code)
+        self.children[pid] = worker_id
+        logging.info(f"Worker {worker_id} started with pid {pid}")
+
+    def run(self):
+        """
+        预热导入后 fork 工作进程，并在其退出时重新拉起
+        """
+        start = time.perf_counter()
+        data_extraction_and_cleaning.warm_imports()
+        logging.info(f"Imports warmed in {time.perf_counter() - start:.3f}s")
+
+        self.running = True
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            worker_id = self.children.pop(pid, None)
+            if worker_id is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            logging.info(f"Worker {worker_id} (pid {pid}) exited with status {code}")
+            if self.running and code != 0:
+                time.sleep(self.respawn_delay)
+                self._spawn(worker_id)
+
+    def signal_handler(self, signum, frame):
+        """
+        处理终止信号，通知所有工作进程退出
+        """
+        logging.info(f"Received signal {signum}. Shutting down workers...")
+        self.running = False
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Prefork worker launcher")
+    parser.add_argument('--num_workers', type=int, default=4, help='Number of worker processes')
+    parser.add_argument('--respawn_delay', type=float, default=1, help='Seconds to wait before respawning a crashed worker')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        logging.critical("Prefork launcher requires os.fork (POSIX only).")
+        sys.exit(1)
+    PreforkLauncher(num_workers=args.num_workers, respawn_delay=args.respawn_delay).run()